@@ -0,0 +1,165 @@
+import os
+import time
+import random
+import sqlite3
+import threading
+from flask import current_app, has_app_context
+from google.api_core import exceptions as api_exceptions
+from .config import Config
+
+# --- SHARED MODEL CLIENT ---
+# Every Gemini call goes through ModelClient: RPM/TPM token buckets and the circuit breaker live in a small
+# SQLite file so all threads and all gunicorn workers on the host draw from one quota. Background calls may
+# not dip into the last AI_BACKGROUND_RESERVE of a bucket, which keeps headroom for interactive requests.
+
+INTERACTIVE, BACKGROUND = 'interactive', 'background'
+RETRYABLE = (api_exceptions.ResourceExhausted, api_exceptions.TooManyRequests, api_exceptions.ServiceUnavailable,
+             api_exceptions.InternalServerError, api_exceptions.DeadlineExceeded, api_exceptions.GatewayTimeout)
+IMAGE_TOKENS = 258        # Gemini bills an image part at a flat token count
+OUTPUT_TOKEN_GUESS = 500  # reserved up front, corrected from usage_metadata afterwards
+
+class AIUnavailable(Exception):
+    """The model can't be called right now (quota exhausted, breaker open, or retries used up)."""
+
+class RateLimited(AIUnavailable):
+    pass
+
+class CircuitOpen(AIUnavailable):
+    pass
+
+def _config(key):
+    return current_app.config.get(key, getattr(Config, key)) if has_app_context() else getattr(Config, key)
+
+class SharedLimits:
+    """Token buckets and breaker state in one SQLite file; BEGIN IMMEDIATE makes each update atomic."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS breaker (name TEXT PRIMARY KEY, failures INTEGER NOT NULL, open_until REAL NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def _atomic(self, fn):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn, time.time())
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def take(self, buckets):
+        """buckets: {name: (cost, capacity, per_second, floor)}. Debits all of them if every bucket stays at or
+        above its floor; otherwise debits nothing. Returns 0 on success or the seconds until it could succeed."""
+        def run(conn, now):
+            levels, wait = {}, 0.0
+            for name, (cost, capacity, rate, floor) in buckets.items():
+                row = conn.execute("SELECT level, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+                level = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+                levels[name] = level
+                if level - cost < floor:
+                    wait = max(wait, (floor + cost - level) / rate)
+            if wait: return wait
+            for name, (cost, *_rest) in buckets.items():
+                conn.execute("INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+                             (name, levels[name] - cost, now))
+            return 0.0
+        return self._atomic(run)
+
+    def adjust(self, name, delta):
+        """Corrects a bucket after the fact (negative delta refunds an over-estimate)."""
+        self._atomic(lambda conn, now: conn.execute("UPDATE buckets SET level = level - ? WHERE name = ?", (delta, name)))
+
+    def open_until(self, name):
+        row = self._conn().execute("SELECT open_until FROM breaker WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0.0
+
+    def record_failure(self, name, threshold, cooldown):
+        def run(conn, now):
+            row = conn.execute("SELECT failures FROM breaker WHERE name = ?", (name,)).fetchone()
+            failures = (row[0] if row else 0) + 1
+            open_until = now + cooldown if failures >= threshold else 0.0
+            conn.execute("INSERT OR REPLACE INTO breaker (name, failures, open_until) VALUES (?, ?, ?)", (name, failures, open_until))
+        self._atomic(run)
+
+    def record_success(self, name):
+        self._atomic(lambda conn, now: conn.execute("DELETE FROM breaker WHERE name = ?", (name,)))
+
+_limits = None
+_limits_lock = threading.Lock()
+
+def sharedLimits():
+    global _limits
+    with _limits_lock:
+        if _limits is None:
+            _limits = SharedLimits(_config('AI_RATE_STORE'))
+        return _limits
+
+def estimateTokens(contents):
+    """Rough prompt size: ~4 characters per token for text, a flat cost per image, plus an output allowance."""
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    tokens = OUTPUT_TOKEN_GUESS
+    for part in parts:
+        tokens += IMAGE_TOKENS if isinstance(part, dict) else len(str(part)) // 4
+    return tokens
+
+class ModelClient:
+    """Drop-in for GenerativeModel.generate_content with shared RPM/TPM budgets, exponential backoff on
+    retryable API errors and a circuit breaker. Raises AIUnavailable instead of leaking quota errors."""
+
+    def __init__(self, model, priority=BACKGROUND):
+        self.model = model
+        self.model_name = model.model_name
+        self.priority = priority
+
+    def _acquire(self, tokens):
+        limits = sharedLimits()
+        rpm, tpm = _config('AI_RPM'), _config('AI_TPM')
+        reserve = _config('AI_BACKGROUND_RESERVE') if self.priority == BACKGROUND else 0.0
+        tokens = min(tokens, tpm * (1 - reserve))  # a single huge prompt must still be admissible
+        deadline = time.monotonic() + _config('AI_MAX_WAIT_INTERACTIVE' if self.priority == INTERACTIVE else 'AI_MAX_WAIT_BACKGROUND')
+        buckets = {f"{self.model_name}:rpm": (1, rpm, rpm / 60, rpm * reserve),
+                   f"{self.model_name}:tpm": (tokens, tpm, tpm / 60, tpm * reserve)}
+        while True:
+            wait = limits.take(buckets)
+            if not wait: return tokens
+            if time.monotonic() + wait > deadline:
+                raise RateLimited(f"AI rate limit reached ({self.priority}); retry in {wait:.0f}s")
+            time.sleep(wait + random.uniform(0, 0.05))
+
+    def generate_content(self, contents, **kwargs):
+        limits = sharedLimits()
+        breaker = f"{self.model_name}:breaker"
+        retries = _config('AI_MAX_RETRIES') if self.priority == BACKGROUND else min(1, _config('AI_MAX_RETRIES'))
+        for attempt in range(retries + 1):
+            remaining = limits.open_until(breaker) - time.time()
+            if remaining > 0:
+                raise CircuitOpen(f"AI temporarily unavailable after repeated errors; retry in {remaining:.0f}s")
+
+            estimate = self._acquire(estimateTokens(contents))
+            try:
+                response = self.model.generate_content(contents, **kwargs)
+            except RETRYABLE as e:
+                limits.record_failure(breaker, _config('AI_BREAKER_THRESHOLD'), _config('AI_BREAKER_COOLDOWN'))
+                if attempt == retries:
+                    raise AIUnavailable(f"AI service is busy: {e}") from e
+                time.sleep(min(2 ** attempt, 30) * random.uniform(0.8, 1.2))
+                continue
+
+            limits.record_success(breaker)
+            usage = getattr(response, 'usage_metadata', None)
+            actual = getattr(usage, 'total_token_count', None)
+            if isinstance(actual, int):
+                limits.adjust(f"{self.model_name}:tpm", actual - estimate)
+            return response
@@ -0,0 +1,151 @@
+import time
+import zlib
+from datetime import timezone
+import numpy as np
+from sqlalchemy import select
+from .extensions import db
+from .models import Expense
+from .utils import addAnomalyWarnings, merchantFingerprint, _userRangeFilter, LARGE_EXPENSE_FLOOR, ANOMALY_MIN_SAMPLES, \
+    DUPLICATE_WINDOW, DUPLICATE_REASON
+
+# --- OFFLINE ANOMALY SCAN ---
+# Pages through the ledger ordered by (user, date) in columnar chunks that never split a user, scores each
+# chunk with NumPy and bulk-inserts AnomalyWarning rows (idempotent on (expense_id, type)). Pages seek on
+# user_id, so no read cursor is held open across the per-chunk commits (SQLite would report the database as
+# locked). Memory is bounded by the chunk size plus the largest single user's history.
+
+ROBUST_Z = 3.5                   # Iglewicz-Hoaglin cut-off on the MAD-based modified z-score
+SPIKE_WINDOW = 90 * 24 * 3600    # trailing window for the spike check
+SPIKE_RATIO = 5.0
+SPIKE_MIN_HISTORY = 5
+
+def _naiveUtc(d):
+    if d.tzinfo: d = d.astimezone(timezone.utc).replace(tzinfo=None)
+    return d
+
+def _columns(rows, since):
+    """Row tuples -> dict of NumPy arrays (plus the id/user lists needed to write warnings back)."""
+    ids, user_ids, categories, types, amounts, dates, titles, fingerprints, created = zip(*rows)
+    users, user_codes = np.unique(np.array([u.int for u in user_ids], dtype=object), return_inverse=True)
+    cats, cat_codes = np.unique(np.array(categories, dtype=object), return_inverse=True)
+    ts = np.array([_naiveUtc(d or c) for d, c in zip(dates, created)], dtype='datetime64[s]').astype(np.int64)
+    cols = {
+        "ids": ids, "user_ids": user_ids, "categories": categories,
+        "user": user_codes.astype(np.int64), "cat": cat_codes.astype(np.int64), "n_cat": len(cats),
+        "paid": np.array([t != 'Received' for t in types]),
+        "amount": np.array([float(a) for a in amounts]),
+        "ts": ts,
+        "merchant": np.array([zlib.crc32((f if f is not None else merchantFingerprint(t)).encode())
+                              for t, f in zip(titles, fingerprints)], dtype=np.int64),
+    }
+    cols["flag"] = np.ones(len(ids), dtype=bool) if since is None else \
+        np.array([_naiveUtc(c) >= since for c in created])
+    return cols
+
+def _groupMedian(keys, values):
+    """Per-group median and size for dense integer group keys."""
+    order = np.lexsort((values, keys))
+    k, v = keys[order], values[order]
+    groups, starts, counts = np.unique(k, return_index=True, return_counts=True)
+    size = keys.max() + 1
+    median, count = np.zeros(size), np.zeros(size, dtype=np.int64)
+    median[groups] = (v[starts + (counts - 1) // 2] + v[starts + counts // 2]) / 2
+    count[groups] = counts
+    return median, count
+
+def robustOutliers(keys, amounts):
+    """Modified z-score 0.6745 * (x - median) / MAD per group. Returns (z, group size); z is 0 where MAD is 0."""
+    median, count = _groupMedian(keys, amounts)
+    deviation = np.abs(amounts - median[keys])
+    mad, _ = _groupMedian(keys, deviation)
+    mad_k = mad[keys]
+    z = np.divide(0.6745 * (amounts - median[keys]), mad_k, out=np.zeros_like(amounts), where=mad_k > 0)
+    return z, count[keys], median[keys]
+
+def trailingMeans(user, ts, amounts, window):
+    """Mean and count of each row's strictly earlier amounts for the same user within `window` seconds."""
+    order = np.lexsort((ts, user))
+    key = (user[order] << 34) + ts[order]  # ts fits in 34 bits until the year 2514
+    start = np.searchsorted(key, key - window, side='left')
+    end = np.searchsorted(key, key, side='left')
+    csum = np.concatenate(([0.0], np.cumsum(amounts[order])))
+    count = end - start
+    mean = np.divide(csum[end] - csum[start], count, out=np.zeros(len(key)), where=count > 0)
+    # Back to the caller's row order
+    out_mean, out_count = np.empty_like(mean), np.empty_like(count)
+    out_mean[order], out_count[order] = mean, count
+    return out_mean, out_count
+
+def duplicateRows(user, merchant, cents, ts, window):
+    """Indices of rows that repeat an earlier row's (user, merchant fingerprint, amount) within `window` seconds."""
+    order = np.lexsort((ts, cents, merchant, user))
+    same = (user[order][1:] == user[order][:-1]) & (merchant[order][1:] == merchant[order][:-1]) & \
+           (cents[order][1:] == cents[order][:-1]) & (ts[order][1:] - ts[order][:-1] <= window)
+    return order[1:][same]
+
+def scoreChunk(cols):
+    """Returns [(row index, type, reason)] for one chunk of complete users."""
+    found = {}
+    paid = np.flatnonzero(cols["paid"])
+    if len(paid):
+        amount, user, cat = cols["amount"][paid], cols["user"][paid], cols["cat"][paid]
+        # 1. Robust z per (user, category), falling back to the user's overall distribution for thin categories
+        z_cat, n_cat, med_cat = robustOutliers(user * cols["n_cat"] + cat, amount)
+        z_all, n_all, med_all = robustOutliers(user, amount)
+        use_cat = n_cat > ANOMALY_MIN_SAMPLES
+        z = np.where(use_cat, z_cat, z_all)
+        enough = np.where(use_cat, True, n_all > ANOMALY_MIN_SAMPLES)
+        median = np.where(use_cat, med_cat, med_all)
+        large = enough & (z >= ROBUST_Z) & (amount > LARGE_EXPENSE_FLOOR)
+        for i in np.flatnonzero(large):
+            scope = f"{cols['categories'][paid[i]]} " if use_cat[i] else ""
+            found[(paid[i], "LARGE_EXPENSE")] = f"Large expense of ₹{amount[i]:,.0f} detected (robust z {z[i]:.1f} vs your median {scope}spend of ₹{median[i]:,.0f})."
+
+        # 2. Spike against the trailing window of the user's own debits
+        mean, count = trailingMeans(user, cols["ts"][paid], amount, SPIKE_WINDOW)
+        spike = ~large & (count >= SPIKE_MIN_HISTORY) & (amount > SPIKE_RATIO * mean) & (amount > LARGE_EXPENSE_FLOOR)
+        for i in np.flatnonzero(spike):
+            found[(paid[i], "SUSPICIOUS_SPIKE")] = f"Spending spike: ₹{amount[i]:,.0f} is {amount[i] / mean[i]:.1f}x your 90-day average of ₹{mean[i]:,.0f}."
+
+    # 3. Duplicate clusters (same merchant fingerprint and amount within 24h)
+    cents = np.round(cols["amount"] * 100).astype(np.int64)
+    for i in duplicateRows(cols["user"], cols["merchant"], cents, cols["ts"], int(DUPLICATE_WINDOW.total_seconds())):
+        found[(i, "DUPLICATE")] = DUPLICATE_REASON
+
+    return [(i, kind, reason) for (i, kind), reason in found.items() if cols["flag"][i]]
+
+def scanAnomalies(since=None, lo=None, hi=None, chunk_rows=200000, progress=None):
+    """Scans every ledger (or the user-id range [lo, hi)) and records new warnings. History always feeds the
+    baselines; with `since` only expenses created after it are flagged. Returns {rows, users, warnings, inserted, seconds}."""
+    started = time.perf_counter()
+    since = None if since is None else _naiveUtc(since)
+    stats = {"rows": 0, "users": 0, "warnings": 0, "inserted": 0}
+    stmt = select(Expense.id, Expense.user_id, Expense.category, Expense.type, Expense.amount,
+                  Expense.expense_date, Expense.title, Expense.merchant_fingerprint, Expense.created_at) \
+        .where(*_userRangeFilter(Expense.user_id, lo, hi)) \
+        .order_by(Expense.user_id, Expense.expense_date, Expense.id)
+
+    def flush(rows):
+        cols = _columns(rows, since)
+        hits = scoreChunk(cols)
+        warnings = [{"user_id": cols["user_ids"][i], "expense_id": cols["ids"][i], "type": kind, "reason": reason}
+                    for i, kind, reason in hits]
+        stats["inserted"] += addAnomalyWarnings(warnings)
+        db.session.commit()
+        stats["rows"] += len(rows); stats["users"] += len(set(cols["user_ids"])); stats["warnings"] += len(hits)
+        if progress: progress(stats)
+
+    after = None
+    while True:
+        page = stmt.where(Expense.user_id > after) if after is not None else stmt
+        rows = db.session.execute(page.limit(chunk_rows)).all()
+        if not rows: break
+        if len(rows) == chunk_rows:  # the last user may run past the page: leave them to the next one
+            cut = len(rows)
+            while cut and rows[cut - 1].user_id == rows[-1].user_id: cut -= 1
+            rows = rows[:cut] if cut else db.session.execute(stmt.where(Expense.user_id == rows[-1].user_id)).all()
+        flush(rows)
+        after = rows[-1].user_id
+
+    stats["seconds"] = round(time.perf_counter() - started, 2)
+    return stats
@@ -0,0 +1,91 @@
+import os
+import uuid
+import hashlib
+from collections import namedtuple
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import update, delete
+from werkzeug.utils import secure_filename
+from .extensions import db
+from .models import StoredBlob
+from .utils import _dialectInsert
+
+# --- CONTENT-ADDRESSED BLOB STORE ---
+# Uploads are streamed to a temp file while their SHA-256 is computed, then moved to <root>/ab/cd/<sha256><ext>.
+# stored_blobs keeps one row per distinct file with a refcount, so identical uploads from any number of users
+# share one copy and the file is unlinked when the last reference goes. Row lock + rename happen in one
+# transaction, which keeps a concurrent store from racing a release of the same blob.
+
+BlobRef = namedtuple('BlobRef', 'sha256 path size mime_type')
+_table = StoredBlob.__table__
+
+def _root():
+    return current_app.config['BLOB_STORE_ROOT']
+
+def blobPath(path):
+    """Absolute filesystem path of a stored blob (or a legacy flat upload name)."""
+    full = os.path.abspath(os.path.join(_root(), path))
+    if not full.startswith(os.path.abspath(_root()) + os.sep):
+        raise ValueError(f"Blob path escapes the store: {path}")
+    return full
+
+def openBlob(path):
+    """Binary file handle; callers read or stream from it instead of loading the whole file."""
+    return open(blobPath(path), 'rb')
+
+def _extension(filename):
+    ext = os.path.splitext(secure_filename(filename or ''))[1].lower()
+    return {'.jpeg': '.jpg'}.get(ext, ext)[:10]
+
+def storeUpload(stream, filename, mime_type=None):
+    """Streams `stream` (a file-like object, e.g. FileStorage.stream) into the store and takes one reference.
+    Returns a BlobRef; release it with releaseBlob(ref.path) when the owner goes away."""
+    chunk_bytes = current_app.config.get('BLOB_CHUNK_BYTES', 1024 * 1024)
+    tmp_dir = os.path.join(_root(), '.tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+    digest, size = hashlib.sha256(), 0
+    try:
+        with open(tmp_path, 'wb') as out:
+            while True:
+                chunk = stream.read(chunk_bytes)
+                if not chunk: break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+
+        sha = digest.hexdigest()
+        now = datetime.utcnow()
+        stmt = _dialectInsert(StoredBlob).values(
+            sha256=sha, path=f"{sha[:2]}/{sha[2:4]}/{sha}{_extension(filename)}", size=size,
+            mime_type=mime_type, refcount=1, created_at=now, updated_at=now)
+        stmt = stmt.on_conflict_do_update(index_elements=['sha256'],
+                                          set_={"refcount": _table.c.refcount + 1, "updated_at": now}) \
+            .returning(_table.c.path, _table.c.mime_type)
+        with db.engine.begin() as conn:
+            # The upsert holds the row lock until the file is in place
+            path, stored_mime = conn.execute(stmt).one()
+            target = blobPath(path)
+            if os.path.exists(target):
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp_path, target)
+        return BlobRef(sha, path, size, stored_mime)
+    finally:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
+
+def releaseBlob(path):
+    """Drops one reference to the blob at `path`; the file is deleted with its last reference.
+    Paths with no stored_blobs row (uploads from before the store) are left alone. Returns True if deleted."""
+    if not path: return False
+    with db.engine.begin() as conn:
+        conn.execute(update(_table).where(_table.c.path == path)
+                     .values(refcount=_table.c.refcount - 1, updated_at=datetime.utcnow()))
+        gone = conn.execute(delete(_table).where(_table.c.path == path, _table.c.refcount <= 0)).rowcount
+        if gone:
+            try:
+                os.remove(blobPath(path))
+            except FileNotFoundError:
+                pass
+    return bool(gone)
@@ -30,3 +30,49 @@ class Config:
     MICRO_PERCENT = float(os.getenv('MICRO_PERCENT', 50))
     SAFE_PERCENT = float(os.getenv('SAFE_PERCENT', 30))
     GROWTH_PERCENT = float(os.getenv('GROWTH_PERCENT', 20))
+
+    # Background MonthlySummary recompute (drains dirty_months, closes ended months); runs in run_worker.py.
+    # The *_IN_APP switches start the background loops inside the dev server (python run_app.py) so a single
+    # process works out of the box; set them to 0 when a separate run_worker.py is running.
+    SUMMARY_WORKER_ENABLED = os.getenv('SUMMARY_WORKER_ENABLED', '1') == '1'
+    SUMMARY_WORKER_IN_APP = os.getenv('SUMMARY_WORKER_IN_APP', '1') == '1'
+    SUMMARY_WORKER_INTERVAL = float(os.getenv('SUMMARY_WORKER_INTERVAL', 5))
+
+    # Bank statement parsing: page-aligned chunks sent to the LLM concurrently
+    STATEMENT_CHUNK_CHARS = int(os.getenv('STATEMENT_CHUNK_CHARS', 12000))
+    STATEMENT_CHUNK_OVERLAP_LINES = int(os.getenv('STATEMENT_CHUNK_OVERLAP_LINES', 3))
+    STATEMENT_LLM_WORKERS = int(os.getenv('STATEMENT_LLM_WORKERS', 4))
+
+    # Durable job queue (run_worker.py); the in-app pool is for single-process dev setups
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+    JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+    JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 600))
+    JOB_RETRY_BASE = float(os.getenv('JOB_RETRY_BASE', 10))
+    JOB_PRIORITY_SLOTS = int(os.getenv('JOB_PRIORITY_SLOTS', 1))  # worker slots only priority jobs may fill
+    JOB_WORKER_IN_APP = os.getenv('JOB_WORKER_IN_APP', '1') == '1'
+
+    # LLM response cache: in-process LRU in front of the llm_cache table
+    LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', '1') == '1'
+    LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', 7 * 24 * 3600))
+    LLM_CACHE_LRU_SIZE = int(os.getenv('LLM_CACHE_LRU_SIZE', 2048))
+    LLM_CACHE_MAX_ROWS = int(os.getenv('LLM_CACHE_MAX_ROWS', 100000))
+
+    # Gemini quota shared by every thread and worker process on the host (see ai_client.py)
+    AI_RPM = int(os.getenv('AI_RPM', 15))
+    AI_TPM = int(os.getenv('AI_TPM', 1000000))
+    AI_BACKGROUND_RESERVE = float(os.getenv('AI_BACKGROUND_RESERVE', 0.2))  # share of each bucket kept for interactive calls
+    AI_MAX_WAIT_INTERACTIVE = float(os.getenv('AI_MAX_WAIT_INTERACTIVE', 10))
+    AI_MAX_WAIT_BACKGROUND = float(os.getenv('AI_MAX_WAIT_BACKGROUND', 120))
+    AI_MAX_RETRIES = int(os.getenv('AI_MAX_RETRIES', 3))
+    AI_BREAKER_THRESHOLD = int(os.getenv('AI_BREAKER_THRESHOLD', 5))
+    AI_BREAKER_COOLDOWN = float(os.getenv('AI_BREAKER_COOLDOWN', 30))
+    AI_RATE_STORE = os.getenv('AI_RATE_STORE') or os.path.join(BASE_DIR, 'instance', 'ai_ratelimit.sqlite')
+
+    # Content-addressed upload storage (see blob_store.py); must stay under static/ while receipts are served from there
+    BLOB_STORE_ROOT = os.getenv('BLOB_STORE_ROOT') or UPLOAD_FOLDER
+    BLOB_CHUNK_BYTES = int(os.getenv('BLOB_CHUNK_BYTES', 1024 * 1024))
+
+    # Receipt images are downsized and re-encoded before they are sent to the model (see receipt_images.py)
+    RECEIPT_MAX_DIM = int(os.getenv('RECEIPT_MAX_DIM', 1600))
+    RECEIPT_JPEG_QUALITY = int(os.getenv('RECEIPT_JPEG_QUALITY', 80))
+    RECEIPT_PDF_PAGES = int(os.getenv('RECEIPT_PDF_PAGES', 1))
@@ -0,0 +1,223 @@
+import os
+import json
+import uuid
+import hashlib
+import time
+import random
+import socket
+import threading
+import functools
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, date
+from decimal import Decimal
+from sqlalchemy import func, case, text
+from flask import current_app
+from .extensions import db
+from .models import Job
+
+# --- DURABLE JOB QUEUE ---
+# Jobs are rows in `jobs`. Any number of worker processes claim them with a compare-and-set UPDATE, so the
+# same code runs on SQLite locally and Postgres in production. A crashed worker's jobs come back after the lease.
+
+CLAIM_LOCK_KEY = 0x6a6f6273  # Postgres advisory lock that serializes claim() across workers
+
+JobSpec = namedtuple('JobSpec', 'handler max_attempts concurrency delay dedupe priority')
+JOB_TYPES = {}
+
+def _jsonable(value):
+    if isinstance(value, (uuid.UUID, Decimal)): return str(value)
+    if isinstance(value, (datetime, date)): return value.isoformat()
+    if isinstance(value, (list, tuple)): return [_jsonable(v) for v in value]
+    if isinstance(value, dict): return {str(k): _jsonable(v) for k, v in value.items()}
+    return value
+
+def enqueue(job_type, args=(), kwargs=None, run_after=None, commit=True):
+    """Persists a job for the worker pool and returns its id. Arguments must be JSON-serializable
+    (UUIDs, Decimals and dates are stored as strings). For dedupe job types an identical call that is
+    still queued absorbs this one and its id is returned instead."""
+    spec = JOB_TYPES[job_type]
+    payload = {"args": [_jsonable(a) for a in args], "kwargs": {k: _jsonable(v) for k, v in (kwargs or {}).items()}}
+    run_after = run_after or datetime.utcnow() + timedelta(seconds=spec.delay)
+    if spec.dedupe:
+        return _enqueueOnce(job_type, spec, payload, run_after, commit)
+
+    job = Job(type=job_type, max_attempts=spec.max_attempts, payload=payload, run_after=run_after)
+    db.session.add(job)
+    if commit: db.session.commit()
+    return job.id
+
+def _enqueueOnce(job_type, spec, payload, run_after, commit):
+    """Insert that yields to the queued twin on the partial unique index (type, dedupe_key) WHERE queued,
+    so concurrent callers can't both add one."""
+    from .utils import _dialectInsert
+    dedupe_key = hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    stmt = _dialectInsert(Job).values(id=uuid.uuid4(), type=job_type, max_attempts=spec.max_attempts, payload=payload,
+                                      dedupe_key=dedupe_key, run_after=run_after) \
+        .on_conflict_do_nothing(index_elements=['type', 'dedupe_key'], index_where=text("status = 'queued'")) \
+        .returning(Job.id)
+    while True:
+        job_id = db.session.execute(stmt).scalar()
+        if job_id is None:  # a queued twin exists, unless a worker claimed it since the insert
+            job_id = db.session.query(Job.id).filter_by(type=job_type, dedupe_key=dedupe_key, status='queued').scalar()
+        if job_id is not None: break
+    if commit: db.session.commit()
+    return job_id
+
+def background_job(name=None, max_attempts=3, concurrency=2, delay=0, dedupe=False, priority=0):
+    """Registers `f` as a job type. Calling the decorated function enqueues it; `.run(...)` executes inline.
+    Handlers run in the worker's long-lived app (one engine and pool per process) and must not build their own;
+    each job gets its own scoped session. `concurrency` caps how many jobs of a type run at once across workers
+    (strict on Postgres, where claims are serialized; best-effort on SQLite).
+    `delay` holds new jobs back that many seconds; with `dedupe` calls with the same arguments made during
+    that window collapse into the one queued job. Types with a higher `priority` are claimed first, and only
+    priority > 0 types may take a worker's reserved slots (for jobs a user is waiting on)."""
+    def decorate(f):
+        job_type = name or f.__name__
+        JOB_TYPES[job_type] = JobSpec(f, max_attempts, concurrency, delay, dedupe, priority)
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            return enqueue(job_type, args, kwargs)
+        wrapper.run = f
+        wrapper.job_type = job_type
+        return wrapper
+    return decorate
+
+def retryDelay(attempts, base=10, cap=900):
+    """Exponential backoff with jitter: base, 2*base, 4*base ... capped."""
+    return min(base * (2 ** (attempts - 1)), cap) * random.uniform(0.8, 1.2)
+
+def requeueStaleJobs(lease_seconds):
+    """Jobs whose worker vanished mid-run go back to the queue (or fail if out of attempts)."""
+    cutoff = datetime.utcnow() - timedelta(seconds=lease_seconds)
+    stale = Job.query.filter(Job.status == 'running', Job.locked_at < cutoff)
+    failed = stale.filter(Job.attempts >= Job.max_attempts) \
+        .update({"status": 'failed', "last_error": 'Lease expired', "locked_by": None}, synchronize_session=False)
+    requeued = stale.update({"status": 'queued', "run_after": datetime.utcnow(), "locked_by": None, "dedupe_key": None},
+                            synchronize_session=False)
+    db.session.commit()
+    return requeued + failed
+
+def purgeFinishedJobs(days=7):
+    """Deletes completed jobs older than `days`; failed jobs are kept for inspection."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    deleted = Job.query.filter(Job.status == 'done', Job.updated_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+class JobWorker:
+    """Fixed-size thread pool fed by a single dispatcher loop that claims due jobs from the table."""
+
+    def __init__(self, app, workers=None, poll_interval=None):
+        self.app = app
+        self.workers = workers or app.config.get('JOB_WORKERS', 4)
+        self.poll_interval = poll_interval or app.config.get('JOB_POLL_INTERVAL', 1)
+        self.lease_seconds = app.config.get('JOB_LEASE_SECONDS', 600)
+        self.retry_base = app.config.get('JOB_RETRY_BASE', 10)
+        self.priority_slots = min(app.config.get('JOB_PRIORITY_SLOTS', 1), self.workers - 1)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self._inflight = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def claim(self, limit):
+        """Claims up to `limit` due jobs whose type is under its concurrency cap, higher priority first.
+        Plain jobs leave the last `priority_slots` free slots alone, so a burst of background work can't
+        keep a receipt the user is waiting on queued. On Postgres the whole claim runs under an advisory lock,
+        so the running counts can't go stale between workers; on SQLite the caps are best-effort. Returns their ids."""
+        now = datetime.utcnow()
+        if db.session.get_bind().dialect.name == 'postgresql':
+            db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": CLAIM_LOCK_KEY})
+        running = dict(db.session.query(Job.type, func.count(Job.id))
+                       .filter(Job.status == 'running', Job.type.in_(list(JOB_TYPES))).group_by(Job.type).all())
+        open_types = [t for t, spec in JOB_TYPES.items() if running.get(t, 0) < spec.concurrency]
+        if not open_types:
+            db.session.commit()
+            return []
+
+        ranks = {t: JOB_TYPES[t].priority for t in open_types if JOB_TYPES[t].priority}
+        order = [case(ranks, value=Job.type, else_=0).desc()] if ranks else []
+        candidates = db.session.query(Job.id, Job.type) \
+            .filter(Job.status == 'queued', Job.run_after <= now, Job.type.in_(open_types)) \
+            .order_by(*order, Job.run_after).limit(limit * 4).all()
+        claimed, plain_limit, plain = [], limit - self.priority_slots, 0
+        for job_id, job_type in candidates:
+            if len(claimed) >= limit: break
+            if running.get(job_type, 0) >= JOB_TYPES[job_type].concurrency: continue
+            if not JOB_TYPES[job_type].priority and plain >= plain_limit: continue
+            won = Job.query.filter(Job.id == job_id, Job.status == 'queued').update(
+                {"status": 'running', "locked_by": self.worker_id, "locked_at": now, "attempts": Job.attempts + 1},
+                synchronize_session=False)
+            if won:
+                claimed.append(job_id)
+                running[job_type] = running.get(job_type, 0) + 1
+                if not JOB_TYPES[job_type].priority: plain += 1
+        db.session.commit()  # releases the claim lock
+        return claimed
+
+    def execute(self, job_id):
+        with self.app.app_context():
+            try:
+                job = Job.query.get(job_id)
+                spec = JOB_TYPES[job.type]
+                args, kwargs = job.payload.get("args", []), job.payload.get("kwargs", {})
+                db.session.commit()
+                try:
+                    spec.handler(*args, **kwargs)
+                    changes = {"status": 'done', "last_error": None}
+                except Exception as e:
+                    db.session.rollback()
+                    job = Job.query.get(job_id)
+                    if job.attempts >= job.max_attempts:
+                        changes = {"status": 'failed'}
+                    else:
+                        delay = retryDelay(job.attempts, self.retry_base)
+                        # A retry drops its dedupe key: a twin may have been queued while this one ran
+                        changes = {"status": 'queued', "run_after": datetime.utcnow() + timedelta(seconds=delay), "dedupe_key": None}
+                    changes["last_error"] = f"{type(e).__name__}: {e}"[:2000]
+                    current_app.logger.warning("Job %s %s attempt %s failed: %s", job.type, job_id, job.attempts, e)
+                # Only settle the row if the lease wasn't taken over in the meantime
+                changes["locked_by"] = None
+                Job.query.filter(Job.id == job_id, Job.locked_by == self.worker_id).update(changes, synchronize_session=False)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.exception("Job worker error on %s: %s", job_id, e)
+            finally:
+                db.session.remove()
+                with self._lock: self._inflight -= 1
+
+    def run_forever(self):
+        last_sweep = 0
+        while not self._stop.is_set():
+            claimed = []
+            with self.app.app_context():
+                try:
+                    if time.monotonic() - last_sweep > 60:
+                        requeueStaleJobs(self.lease_seconds)
+                        purgeFinishedJobs()
+                        last_sweep = time.monotonic()
+                    with self._lock: free = self.workers - self._inflight
+                    if free > 0: claimed = self.claim(free)
+                except Exception as e:
+                    db.session.rollback()
+                    current_app.logger.exception("Job dispatcher error: %s", e)
+                finally:
+                    db.session.remove()
+            for job_id in claimed:
+                with self._lock: self._inflight += 1
+                self._pool.submit(self.execute, job_id)
+            if not claimed:
+                self._stop.wait(self.poll_interval)
+
+    def start(self):
+        thread = threading.Thread(target=self.run_forever, name='job-dispatcher', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self, wait=True):
+        """Stops claiming; with wait=True lets in-flight jobs finish."""
+        self._stop.set()
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,128 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import select, update, delete, insert
+from sqlalchemy.exc import IntegrityError
+from .extensions import db
+from .models import LLMCacheEntry
+
+# --- LLM RESPONSE CACHE ---
+# Two tiers: a per-process LRU, then the llm_cache table shared by every web and worker process.
+# The table is written through its own connection so a cache write never commits the caller's session.
+
+EVICT_EVERY = 200  # DB stores between TTL/size sweeps
+
+_lru = OrderedDict()
+_lock = threading.Lock()
+_stats = {"lru_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "evicted": 0}
+_table = LLMCacheEntry.__table__
+
+def _config(key, default):
+    return current_app.config.get(key, default) if has_app_context() else default
+
+def _count(stat, n=1):
+    with _lock: _stats[stat] += n
+
+def _normalizePart(part):
+    if isinstance(part, str): return ' '.join(part.split())
+    if isinstance(part, dict):
+        data = part.get('data', b'')
+        data = data if isinstance(data, bytes) else str(data).encode()
+        return {"mime_type": part.get('mime_type'), "sha256": hashlib.sha256(data).hexdigest()}
+    return str(part)
+
+def cacheKey(model_name, contents):
+    """sha256 over the model name and the prompt parts, with whitespace collapsed and binary parts hashed."""
+    parts = contents if isinstance(contents, (list, tuple)) else [contents]
+    payload = json.dumps([model_name, [_normalizePart(p) for p in parts]], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _lruGet(key):
+    with _lock:
+        item = _lru.get(key)
+        if item is None: return None
+        if item[1] <= datetime.utcnow():
+            del _lru[key]; return None
+        _lru.move_to_end(key)
+        return item[0]
+
+def _lruPut(key, text, expires_at):
+    with _lock:
+        _lru[key] = (text, expires_at)
+        _lru.move_to_end(key)
+        while len(_lru) > _config('LLM_CACHE_LRU_SIZE', 2048):
+            _lru.popitem(last=False)
+
+def _dbGet(key):
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        row = conn.execute(select(_table.c.response, _table.c.expires_at)
+                           .where(_table.c.key == key, _table.c.expires_at > now)).first()
+        if row:
+            conn.execute(update(_table).where(_table.c.key == key)
+                         .values(hits=_table.c.hits + 1, last_hit_at=now))
+    return row
+
+def _dbPut(key, model_name, text, expires_at):
+    now = datetime.utcnow()
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(delete(_table).where(_table.c.key == key, _table.c.expires_at <= now))
+            conn.execute(insert(_table).values(key=key, model=model_name[:100], response=text, hits=0,
+                                               created_at=now, last_hit_at=now, expires_at=expires_at))
+    except IntegrityError:
+        return  # Another process stored the same response first
+    with _lock:
+        _stats["stores"] += 1
+        sweep = _stats["stores"] % EVICT_EVERY == 0
+    if sweep: evictLLMCache()
+
+def evictLLMCache(max_rows=None):
+    """Drops expired rows, then the least recently hit rows beyond max_rows. Returns rows removed."""
+    max_rows = max_rows or _config('LLM_CACHE_MAX_ROWS', 100000)
+    with db.engine.begin() as conn:
+        removed = conn.execute(delete(_table).where(_table.c.expires_at <= datetime.utcnow())).rowcount
+        cutoff = conn.execute(select(_table.c.last_hit_at).order_by(_table.c.last_hit_at.desc())
+                              .offset(max_rows).limit(1)).scalar()
+        if cutoff is not None:
+            removed += conn.execute(delete(_table).where(_table.c.last_hit_at <= cutoff)).rowcount
+    _count("evicted", removed)
+    return removed
+
+def cachedGenerate(model, contents, ttl=None):
+    """model.generate_content(contents).text, served from cache when the same model saw the same prompt.
+    Only successful responses are stored; errors (quota, blocked prompts) propagate uncached."""
+    if not _config('LLM_CACHE_ENABLED', True):
+        return model.generate_content(contents).text
+
+    model_name = getattr(model, 'model_name', type(model).__name__)
+    key = cacheKey(model_name, contents)
+    text = _lruGet(key)
+    if text is not None:
+        _count("lru_hits"); return text
+
+    use_db = has_app_context()
+    if use_db:
+        row = _dbGet(key)
+        if row:
+            _count("db_hits")
+            _lruPut(key, row.response, row.expires_at)
+            return row.response
+
+    _count("misses")
+    text = model.generate_content(contents).text
+    expires_at = datetime.utcnow() + timedelta(seconds=ttl or _config('LLM_CACHE_TTL', 7 * 24 * 3600))
+    _lruPut(key, text, expires_at)
+    if use_db: _dbPut(key, model_name, text, expires_at)
+    return text
+
+def llmCacheStats():
+    """Hit/miss counters for this process plus the LRU size."""
+    with _lock:
+        stats = dict(_stats, lru_size=len(_lru))
+    lookups = stats["lru_hits"] + stats["db_hits"] + stats["misses"]
+    stats["hit_rate"] = round((stats["lru_hits"] + stats["db_hits"]) / lookups, 4) if lookups else 0.0
+    return stats
@@ -0,0 +1,118 @@
+import time
+import threading
+from sqlalchemy import or_, and_
+from .extensions import db
+from .models import Expense
+from .utils import CATS, merchantTokens
+
+# --- MERCHANT INDEX ---
+# Learned merchant -> category lookup so categorize_batch only calls the model on a miss.
+# Titles are reduced with utils.merchantTokens. A shared prefix trie holds category counts from every user's
+# history; per-user override maps hold each user's own latest choice. Only categories a user set are learned
+# (manual and receipt entries): statement rows carry the extraction model's guess, and ai_category_suggestion
+# values (including ones this index produced) are never folded back in.
+
+LEARNABLE = [c for c in CATS if c != 'Others']
+_CAT_INDEX = {c: i for i, c in enumerate(LEARNABLE)}
+
+def _categoryIndex(category):
+    return _CAT_INDEX.get(category)
+
+class _Node:
+    __slots__ = ('children', 'counts')
+
+    def __init__(self):
+        self.children = None  # token -> _Node, allocated on first child
+        self.counts = None    # category index -> count
+
+class MerchantIndex:
+    """Process-wide index; refreshed incrementally from expenses created since the last scan."""
+
+    def __init__(self, min_support=2, min_share=0.6, refresh_interval=60, rebuild_interval=6 * 3600):
+        self.min_support = min_support
+        self.min_share = min_share
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.Lock()
+        self._reset()
+        self.stats = {"hits": 0, "user_hits": 0, "misses": 0}
+
+    def _reset(self):
+        self.root = _Node()
+        self.overrides = {}      # user_id -> {token tuple: category index}
+        self.nodes = 1
+        self.high_water = None   # (created_at, id) of the last expense folded in
+        self.refreshed_at = 0
+        self.built_at = time.monotonic()
+
+    def _add(self, user_id, tokens, cat):
+        node = self.root
+        for tok in tokens:
+            if node.children is None: node.children = {}
+            child = node.children.get(tok)
+            if child is None:
+                child = node.children[tok] = _Node()
+                self.nodes += 1
+            node = child
+            if node.counts is None: node.counts = {}
+            node.counts[cat] = node.counts.get(cat, 0) + 1
+        # Rows arrive in creation order, so the latest choice per merchant wins
+        self.overrides.setdefault(user_id, {})[tokens] = cat
+
+    def refresh(self, batch_size=5000):
+        """Folds in learnable expenses created after the high-water mark. Returns how many were added."""
+        added = 0
+        with self._lock:
+            if time.monotonic() - self.built_at > self.rebuild_interval:
+                self._reset()  # Full rebuild picks up deletions and recategorized rows
+            while True:
+                q = db.session.query(Expense.user_id, Expense.title, Expense.category, Expense.created_at, Expense.id) \
+                    .filter(Expense.category != 'Others', Expense.is_parsed == False)
+                if self.high_water:
+                    ts, row_id = self.high_water
+                    q = q.filter(or_(Expense.created_at > ts, and_(Expense.created_at == ts, Expense.id > row_id)))
+                rows = q.order_by(Expense.created_at, Expense.id).limit(batch_size).all()
+                for user_id, title, category, created_at, row_id in rows:
+                    cat, tokens = _categoryIndex(category), merchantTokens(title)
+                    if cat is not None and tokens:
+                        self._add(str(user_id), tokens, cat); added += 1
+                if rows: self.high_water = (rows[-1].created_at, rows[-1].id)
+                if len(rows) < batch_size: break
+            self.refreshed_at = time.monotonic()
+        return added
+
+    def lookup(self, user_id, title):
+        """Category for `title`, or None when the index isn't confident. The user's own history wins, then
+        the deepest trie node with enough support and a clear majority."""
+        if time.monotonic() - self.refreshed_at > self.refresh_interval:
+            self.refresh()
+        tokens = merchantTokens(title)
+        if not tokens:
+            self.stats["misses"] += 1; return None
+
+        with self._lock:
+            own = self.overrides.get(str(user_id))
+            if own:
+                for n in range(len(tokens), 0, -1):
+                    cat = own.get(tokens[:n])
+                    if cat is not None:
+                        self.stats["user_hits"] += 1; return LEARNABLE[cat]
+
+            node, best = self.root, None
+            for tok in tokens:
+                node = node.children.get(tok) if node.children else None
+                if node is None: break
+                total = sum(node.counts.values())
+                cat, count = max(node.counts.items(), key=lambda kv: kv[1])
+                if total >= self.min_support and count / total >= self.min_share:
+                    best = cat
+            if best is None:
+                self.stats["misses"] += 1; return None
+            self.stats["hits"] += 1
+            return LEARNABLE[best]
+
+    def summary(self):
+        return dict(self.stats, nodes=self.nodes, users=len(self.overrides),
+                    overrides=sum(len(m) for m in self.overrides.values()))
+
+merchantIndex = MerchantIndex()
@@ -61,6 +61,7 @@ class User(db.Model):
     refresh_tokens = db.relationship('RefreshToken', backref='user', lazy=True, cascade="all, delete-orphan")
     expenses = db.relationship('Expense', backref='owner', lazy=True, cascade="all, delete-orphan")
     monthly_summaries = db.relationship('MonthlySummary', backref='user', lazy=True, cascade="all, delete-orphan")
+    ledger_totals = db.relationship('UserLedgerTotals', backref='user', lazy=True, uselist=False, cascade="all, delete-orphan")
     chat_sessions = db.relationship('ChatSession', backref='user', lazy=True, cascade="all, delete-orphan")
 
 
@@ -149,6 +150,7 @@ class Expense(db.Model):
     is_parsed = db.Column(db.Boolean, default=False)
     statement_tag = db.Column(db.String(100)) # e.g. "HDFC_Statement_Feb.pdf"
     transaction_hash = db.Column(db.String(64), unique=True, index=True) # For duplicate protection
+    merchant_fingerprint = db.Column(db.String(64)) # utils.merchantFingerprint(title), for fuzzy duplicate checks
     include_in_total = db.Column(db.Boolean, default=True)
     
     # AI Metadata
@@ -159,6 +161,10 @@ class Expense(db.Model):
 
     __table_args__ = (
         db.Index('idx_expenses_user_date', 'user_id', text('expense_date DESC')),
+        # Incremental scans (merchant index refresh)
+        db.Index('idx_expenses_created', 'created_at', 'id'),
+        # Duplicate-charge probe: equality on the first three columns, range on the date
+        db.Index('idx_expenses_duplicate', 'user_id', 'amount', 'merchant_fingerprint', 'expense_date'),
     )
 
 
@@ -184,6 +190,100 @@ class MonthlySummary(db.Model):
     )
 
 
+class DailyExpenseRollup(db.Model):
+    __tablename__ = 'daily_expense_rollups'
+
+    # Per-day included totals, maintained on write; chart/time-series reads never touch raw expenses
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    type = db.Column(db.String(20), primary_key=True)
+
+    total_amount = db.Column(db.Numeric(15, 2), default=0.00, nullable=False)
+    txn_count = db.Column(db.Integer, default=0, nullable=False)
+
+
+class DirtyMonth(db.Model):
+    __tablename__ = 'dirty_months'
+
+    # (user, year, month) whose MonthlySummary needs a full recompute by the background worker
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    marked_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+
+
+class UserLedgerTotals(db.Model):
+    __tablename__ = 'user_ledger_totals'
+
+    # One row per user, kept in step with Expense writes (all-time included totals)
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    total_income = db.Column(db.Numeric(15, 2), default=0.00, nullable=False)
+    total_expenses = db.Column(db.Numeric(15, 2), default=0.00, nullable=False)
+
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class SpendingStats(db.Model):
+    __tablename__ = 'spending_stats'
+
+    # Running count / mean / M2 (Welford) of Paid amounts per user and category; category '*' is all categories
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    n = db.Column(db.Integer, default=0, nullable=False)
+    mean = db.Column(db.Float, default=0.0, nullable=False)
+    m2 = db.Column(db.Float, default=0.0, nullable=False)
+
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    # Durable background work (AI calls, anomaly scans); claimed by the pool in run_worker.py
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(JSONB, default={})
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued | running | done | failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=3, nullable=False)
+    run_after = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime(timezone=True))
+    last_error = db.Column(db.Text)
+    dedupe_key = db.Column(db.String(40))  # set for job types that coalesce identical queued calls
+
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_jobs_claim', 'status', 'run_after'),
+        db.Index('idx_jobs_type_status', 'type', 'status'),
+        # One queued job per dedupe key; enqueue() inserts with ON CONFLICT DO NOTHING against it
+        db.Index('uq_jobs_dedupe_queued', 'type', 'dedupe_key', unique=True,
+                 postgresql_where=text("status = 'queued'"), sqlite_where=text("status = 'queued'")),
+    )
+
+
+class LLMCacheEntry(db.Model):
+    __tablename__ = 'llm_cache'
+
+    # Content-addressed model responses: key = sha256(model name + normalized prompt parts)
+    key = db.Column(db.String(64), primary_key=True)
+    model = db.Column(db.String(100), nullable=False)
+    response = db.Column(db.Text, nullable=False)
+    hits = db.Column(db.Integer, default=0, nullable=False)
+
+    created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+    last_hit_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_llm_cache_expires', 'expires_at'),
+        db.Index('idx_llm_cache_last_hit', 'last_hit_at'),
+    )
+
+
 class ChatSession(db.Model):
     __tablename__ = 'chat_sessions'
 
@@ -277,6 +377,7 @@ class AIReport(db.Model):
     month = db.Column(db.Integer)
     content = db.Column(db.Text) # Human readable report
     data_snapshot = db.Column(JSONB) # Raw stats used
+    snapshot_fingerprint = db.Column(db.String(64)) # sha256 of the report inputs; unchanged inputs skip regeneration
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
 
 class InvestmentPlan(db.Model):
@@ -288,6 +389,33 @@ class InvestmentPlan(db.Model):
     advice_text = db.Column(db.Text)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
 
+class StoredBlob(db.Model):
+    __tablename__ = 'stored_blobs'
+
+    # One row per distinct uploaded file; expenses reference it by `path` (Expense.attachment_url)
+    sha256 = db.Column(db.String(64), primary_key=True)
+    path = db.Column(db.String(255), nullable=False, unique=True)  # relative to BLOB_STORE_ROOT
+    size = db.Column(db.BigInteger, nullable=False)
+    mime_type = db.Column(db.String(100))
+    refcount = db.Column(db.Integer, default=0, nullable=False)
+
+    created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+
+class ReceiptAnalysis(db.Model):
+    __tablename__ = 'receipt_analyses'
+
+    # Extracted receipt fields keyed by the file's SHA-256, so a re-upload of the same file is answered at once
+    sha256 = db.Column(db.String(64), primary_key=True)
+    status = db.Column(db.String(20), default='done', nullable=False)  # done, failed
+    result = db.Column(JSONB)
+    error = db.Column(db.Text)
+    original_bytes = db.Column(db.BigInteger)   # upload size
+    compacted_bytes = db.Column(db.BigInteger)  # size actually sent to the model
+
+    created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, nullable=False)
+
 class AnomalyWarning(db.Model):
     __tablename__ = 'anomaly_warnings'
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -298,6 +426,12 @@ class AnomalyWarning(db.Model):
     is_resolved = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now())
 
+    __table_args__ = (
+        db.Index('idx_anomaly_warnings_user_open', 'user_id', 'is_resolved', text('created_at DESC')),
+        # One warning per expense and type, whichever detector (inline or offline scan) gets there first
+        db.Index('uq_anomaly_warnings_expense_type', 'expense_id', 'type', unique=True),
+    )
+
 class SavingsRecommendation(db.Model):
     __tablename__ = 'savings_recommendations'
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
@@ -0,0 +1,78 @@
+import io
+from collections import namedtuple
+from PIL import Image, ImageOps
+from .config import Config
+
+# --- RECEIPT COMPACTION ---
+# Phone photos arrive at 4-12 MB; the model reads a receipt just as well at ~1600px. Before upload the real
+# type is sniffed from the magic bytes, images are EXIF-rotated, downsized and re-encoded as JPEG without
+# metadata, and PDFs are rendered to an image of their first page(s). Anything Pillow can't read goes as-is.
+
+CompactReceipt = namedtuple('CompactReceipt', 'data mime_type original_bytes compacted_bytes width height')
+MODEL_MIME_TYPES = {'image/jpeg', 'image/png', 'image/webp', 'image/heic', 'image/heif', 'application/pdf'}
+
+def sniffMimeType(head):
+    """MIME type from the first bytes of a file; None when unrecognized."""
+    if head.startswith(b'\xff\xd8\xff'): return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'): return 'image/png'
+    if head.startswith(b'%PDF'): return 'application/pdf'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP': return 'image/webp'
+    if head.startswith((b'GIF87a', b'GIF89a')): return 'image/gif'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'heic', b'heix', b'mif1', b'msf1'): return 'image/heic'
+    return None
+
+def _renderPdf(stream, max_dim, pages):
+    """(image of the first `pages` pages stacked vertically, each rendered to fit max_dim wide; total page count)."""
+    import pdfplumber
+    images = []
+    with pdfplumber.open(stream) as pdf:
+        page_count = len(pdf.pages)
+        for page in pdf.pages[:pages]:
+            resolution = max(36, min(200, 72 * max_dim / max(float(page.width), 1)))
+            images.append(page.to_image(resolution=resolution).original.convert('L'))  # printed text: gray is enough
+    if len(images) == 1: return images[0], page_count
+    sheet = Image.new('L', (max(i.width for i in images), sum(i.height for i in images)), 255)
+    top = 0
+    for img in images:
+        sheet.paste(img, (0, top)); top += img.height
+    return sheet, page_count
+
+def _encode(img, max_dim, quality):
+    if img.mode not in ('RGB', 'L'): img = img.convert('RGB')
+    img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality=quality, optimize=True)  # no exif= argument, so metadata is dropped
+    return out.getvalue(), img.size
+
+def compactReceipt(source, declared_mime=None, max_dim=None, quality=None, pdf_pages=None):
+    """Returns a CompactReceipt ready for the model. `source` is bytes or a seekable binary file handle, which
+    Pillow/pdfplumber decode straight from the file; it is only read whole when it goes to the model unchanged.
+    A small image without metadata, or a short PDF, that wouldn't shrink is sent unchanged; undecodable input
+    is passed through with its sniffed (or declared) type."""
+    max_dim = max_dim or Config.RECEIPT_MAX_DIM
+    quality = quality or Config.RECEIPT_JPEG_QUALITY
+    pdf_pages = pdf_pages or Config.RECEIPT_PDF_PAGES
+    stream = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+    mime_type = sniffMimeType(stream.read(16)) or declared_mime or 'application/octet-stream'
+    original = stream.seek(0, io.SEEK_END)
+
+    def unchanged():
+        stream.seek(0)
+        return stream.read()
+
+    try:
+        stream.seek(0)
+        if mime_type == 'application/pdf':
+            img, page_count = _renderPdf(stream, max_dim, pdf_pages)
+            untouched = page_count <= pdf_pages
+        else:
+            img = Image.open(stream)
+            untouched = mime_type in MODEL_MIME_TYPES and max(img.size) <= max_dim and not img.getexif()
+            img = ImageOps.exif_transpose(img)
+        compacted, (width, height) = _encode(img, max_dim, quality)
+    except Exception:
+        return CompactReceipt(unchanged(), mime_type, original, original, None, None)
+
+    if untouched and len(compacted) >= original:
+        return CompactReceipt(unchanged(), mime_type, original, original, width, height)
+    return CompactReceipt(compacted, 'image/jpeg', original, len(compacted), width, height)
@@ -1,11 +1,13 @@
 from flask import Blueprint, render_template, session, redirect, url_for, request
 import os
 from ..extensions import db
-from ..models import User, Expense, MonthlySummary
-from ..utils import runMonthlyEvaluation
+from ..models import User, UserRole, Expense, MonthlySummary, AnomalyWarning, LLMCacheEntry
+from ..llm_cache import llmCacheStats
+from ..merchant_index import merchantIndex
+from ..utils import markRecentMonthsDirty, getCurrentBalance, ledgerStats, monthBounds, inPeriod, rollupSeries, BUCKETS, keysetPage
 from sqlalchemy import func
 import calendar
-from datetime import datetime
+from datetime import datetime, timedelta
 
 bp = Blueprint('main', __name__)
 
@@ -24,8 +26,7 @@ def index():
         
     if not user.full_name or user.monthly_income == 0: return redirect(url_for('main.profile'))
     
-    runMonthlyEvaluation(session['user_id']) # Pass ID from session (string)
-    
+    # Read-only: summaries are materialized by the write path and the background summary worker
     now = datetime.utcnow()
     current_summary = MonthlySummary.query.filter_by(user_id=user.id, year=now.year, month=now.month).first()
     
@@ -36,10 +37,10 @@ def index():
 
     total_paid = current_summary.total_expenses if current_summary else 0
     # Ledger Truth: Total received from transactions in THIS month
-    total_received = db.session.query(func.sum(Expense.amount)).filter_by(user_id=user.id, type='Received', include_in_total=True).filter(func.extract('year', Expense.expense_date) == now.year, func.extract('month', Expense.expense_date) == now.month).scalar() or 0
+    total_received = ledgerStats(user.id, Expense.include_in_total == True, inPeriod(monthBounds(now.year, now.month)))["all_time"]["Received"]
     
-    # Dashboard derives from ledger-calculated summary
-    current_balance = current_summary.current_balance if current_summary else user.monthly_income
+    # Dashboard derives from the per-user running ledger totals (primary-key lookup)
+    current_balance = getCurrentBalance(user)
     
     recent = Expense.query.filter_by(user_id=user.id).order_by(Expense.expense_date.desc()).limit(5).all()
     
@@ -64,11 +65,11 @@ def index():
         progress_percent = min(100, max(0, float((current_balance / user.savings_goal) * 100)))
 
     # MODULE 4: PRODUCTION AI SPENDING INSIGHTS
-    from ..models import AIReport, AnomalyWarning
+    from ..models import AIReport
     ai_report = AIReport.query.filter_by(user_id=user.id, year=now.year, month=now.month).first()
     
     # MODULE 6: ANOMALY DETECTION ALERTS
-    active_anomalies = AnomalyWarning.query.filter_by(user_id=user.id, is_resolved=False).order_by(AnomalyWarning.created_at.desc()).all()
+    active_anomalies, anomaly_cursor = _anomaly_page(user.id)
 
     # Fallback for small advice if report not generated yet
     ai_insight = ai_report.content if ai_report else "AI is analyzing your spending patterns... check back in a moment! 🤖"
@@ -78,7 +79,26 @@ def index():
                            savings_msg=savings_msg, progress_percent=progress_percent,
                            current_month_name=calendar.month_name[now.month],
                            past_summaries=past_summaries, ai_insight=ai_insight,
-                           active_anomalies=active_anomalies)
+                           active_anomalies=active_anomalies, anomaly_cursor=anomaly_cursor)
+
+ANOMALY_PAGE_SIZE = 10
+
+def _anomaly_page(user_id, cursor=None, limit=ANOMALY_PAGE_SIZE):
+    q = AnomalyWarning.query.filter_by(user_id=user_id, is_resolved=False)
+    return keysetPage(q, AnomalyWarning.created_at, AnomalyWarning.id, cursor=cursor, limit=limit)
+
+@bp.route('/api/anomalies')
+def list_anomalies():
+    if 'user_id' not in session: return {"error": "Unauthorized"}, 401
+    try:
+        rows, next_cursor = _anomaly_page(session['user_id'], cursor=request.args.get('cursor'))
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return {
+        "items": [{"id": str(a.id), "expense_id": str(a.expense_id) if a.expense_id else None, "type": a.type,
+                   "reason": a.reason, "created_at": a.created_at.isoformat() if a.created_at else None} for a in rows],
+        "next_cursor": next_cursor
+    }
 
 @bp.route('/api/dashboard/stats')
 def dashboard_stats():
@@ -87,17 +107,44 @@ def dashboard_stats():
     user = User.query.get(u_id)
     now = datetime.utcnow()
     
-    # Recalculate to ensure absolute fresh data
-    from ..utils import calculateMonthlySummary
-    summary = calculateMonthlySummary(u_id, now.year, now.month)
+    # Materialized summary; the balance comes from the running ledger totals
+    summary = MonthlySummary.query.filter_by(user_id=user.id, year=now.year, month=now.month).first()
+    current_balance = getCurrentBalance(user)
     
     return {
-        "total_spent": float(summary.total_expenses),
-        "total_income": float(summary.total_income),
-        "current_balance": float(summary.current_balance),
-        "goal_progress": float((summary.current_balance / user.savings_goal * 100)) if user.savings_goal > 0 else 0
+        "total_spent": float(summary.total_expenses) if summary else 0.0,
+        "total_income": float(summary.total_income) if summary else float(user.monthly_income or 0),
+        "current_balance": float(current_balance),
+        "goal_progress": float((current_balance / user.savings_goal * 100)) if user.savings_goal > 0 else 0
     }
 
+@bp.route('/api/timeseries')
+def timeseries():
+    if 'user_id' not in session: return {"error": "Unauthorized"}, 401
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in BUCKETS: return {"error": f"bucket must be one of {', '.join(BUCKETS)}"}, 400
+
+    try:
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else datetime.utcnow().date()
+        start = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else end - timedelta(days=29)
+    except ValueError:
+        return {"error": "from/to must be YYYY-MM-DD"}, 400
+    if start > end: return {"error": "from must not be after to"}, 400
+    if (end - start).days > 366 * 5: return {"error": "Range too large (max 5 years)"}, 400
+
+    return rollupSeries(session['user_id'], start, end, bucket=bucket, category=request.args.get('category'))
+
+@bp.route('/api/admin/llm-cache')
+def llm_cache_stats():
+    """LLM cache counters for this process plus the shared table's size and lifetime hits (admins only).
+    Merchant index hits are included since they are answered before the cache is consulted."""
+    if 'user_id' not in session: return {"error": "Unauthorized"}, 401
+    user = User.query.get(session['user_id'])
+    if not user or user.role != UserRole.ADMIN: return {"error": "Forbidden"}, 403
+
+    rows, hits = db.session.query(func.count(LLMCacheEntry.key), func.coalesce(func.sum(LLMCacheEntry.hits), 0)).one()
+    return {"process": llmCacheStats(), "table": {"rows": rows, "hits": int(hits)}, "merchant_index": merchantIndex.summary()}
+
 @bp.route('/profile', methods=['GET', 'POST'])
 def profile():
     if 'user_id' not in session: return redirect(url_for('auth.login'))
@@ -108,7 +155,7 @@ def profile():
         user.full_name = request.form.get('full_name')
         user.monthly_income = float(request.form.get('income'))
         user.savings_goal = float(request.form.get('goal'))
+        markRecentMonthsDirty(user.id)
         db.session.commit()
-        runMonthlyEvaluation(session['user_id'])
         return redirect(url_for('main.index'))
     return render_template('profile.html', user=user)
@@ -1,17 +1,44 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, current_app, Response, stream_with_context
 from ..extensions import db
-from ..models import Expense, User
-from ..utils import runMonthlyEvaluation, CATS, detect_anomalies, categorize_with_ai, generate_spending_insights
-from sqlalchemy import func
+from ..models import Expense, User, UserRole, Job, ReceiptAnalysis
+from ..utils import applyExpenseDelta, setExpenseIncluded, ingestParsedTransactions, ledgerStats, keysetPage, PAGE_SIZE, inPeriod, CATS, detect_anomalies, detect_statement_anomalies, merchantFingerprint, categorize_batch, generate_spending_insights, get_ai_model, analyze_receipt_file
+from ..statements import read_statement, extract_transactions
+from ..ai_client import INTERACTIVE
+from ..blob_store import storeUpload, releaseBlob, blobPath
 from werkzeug.utils import secure_filename
-import os
-import pdfplumber
 import re
-import hashlib
+import csv
+import io
+import zlib
 from datetime import datetime, timedelta
 
 bp = Blueprint('transactions', __name__)
 
+# Listing filters shared by the HTML pages and the infinite-scroll API
+EXPENSE_VIEWS = {
+    'manual': (Expense.is_parsed == False, Expense.attachment_url == None),
+    'parsed': (Expense.is_parsed == True,),
+    'receipts': (Expense.attachment_url != None,),
+}
+
+def _expense_page(u_id, view, cursor=None, limit=PAGE_SIZE):
+    q = Expense.query.filter(Expense.user_id == u_id, *EXPENSE_VIEWS[view])
+    return keysetPage(q, Expense.expense_date, Expense.id, cursor=cursor, limit=limit)
+
+def _expense_json(e):
+    return {
+        "id": str(e.id),
+        "title": e.title,
+        "amount": str(e.amount),
+        "category": e.category,
+        "type": e.type,
+        "expense_date": e.expense_date.isoformat() if e.expense_date else None,
+        "date_label": e.expense_date.strftime('%b %d') if e.expense_date else 'N/A',
+        "statement_tag": e.statement_tag,
+        "include_in_total": e.include_in_total is not False,
+        "attachment_url": e.attachment_url
+    }
+
 @bp.route('/add', methods=['POST'])
 def add_expense():
     if 'user_id' not in session: return redirect(url_for('auth.login'))
@@ -21,14 +48,17 @@ def add_expense():
     include_in_total = 'include_total' in request.form
     
     new_exp = Expense(user_id=session['user_id'], title=title, amount=abs(amount), 
+                      merchant_fingerprint=merchantFingerprint(title),
                       category=category, type="Paid" if amount > 0 else "Received",
                       include_in_total=include_in_total)
-    db.session.add(new_exp); db.session.commit()
-    runMonthlyEvaluation(session['user_id'])
+    db.session.add(new_exp); db.session.flush()
+    applyExpenseDelta(new_exp)
+    db.session.commit()
     
     # AI PRODUCTION MODULES (Production Real-time Async)
     detect_anomalies(session['user_id'], new_exp.id)
-    categorize_with_ai(new_exp.id)
+    if new_exp.category == 'Others':
+        categorize_batch(session['user_id'])  # coalesced per user over a short window
     now = datetime.utcnow()
     generate_spending_insights(session['user_id'], now.year, now.month)
 
@@ -42,12 +72,23 @@ def delete_expense(id):
     # Ensure ID comparison works (UUID str vs UUID obj usually handled by SA, 
     # but strictly casting user_id to string for safety if exp.user_id is UUID obj)
     if str(exp.user_id) == str(session['user_id']):
-        db.session.delete(exp); db.session.commit()
-        runMonthlyEvaluation(session['user_id'])
+        db.session.delete(exp); db.session.flush()
+        applyExpenseDelta(exp, sign=-1)
+        db.session.commit()
+        releaseBlob(exp.attachment_url)
         flash('Deleted successfully.', 'info')
     return redirect(request.referrer or '/')
 
-import google.generativeai as genai
+@bp.route('/toggle_include/<id>')
+def toggle_include(id):
+    if 'user_id' not in session: return redirect(url_for('auth.login'))
+    exp = Expense.query.get_or_404(id)
+    if str(exp.user_id) == str(session['user_id']):
+        setExpenseIncluded(exp, exp.include_in_total is False)
+        db.session.commit()
+        flash('Included in totals.' if exp.include_in_total else 'Excluded from totals.', 'info')
+    return redirect(request.referrer or '/')
+
 import json
 
 @bp.route('/parser', methods=['GET', 'POST'])
@@ -58,98 +99,57 @@ def parser():
         file = request.files.get('statement')
         if file and file.filename.endswith('.pdf'):
             filename = secure_filename(file.filename)
-            fpath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            file.save(fpath)
+            # Only needed while parsing: the reference is dropped again below
+            blob = storeUpload(file.stream, filename, file.mimetype)
             
             try:
-                # 1. Extract Text
-                with pdfplumber.open(fpath) as pdf:
-                    text = ""
-                    for page in pdf.pages: text += page.extract_text() or ""
-                
-                # 2. Configure GenAI
-                api_key = os.getenv('GOOGLE_API_KEY')
-                if not api_key:
-                    flash('Server Error: GOOGLE_API_KEY missing.', 'danger')
-                    return redirect(url_for('transactions.parser'))
-
-                genai.configure(api_key=api_key)
-                model = genai.GenerativeModel('gemini-flash-latest')
-
-                # 3. Prompt Engineering
-                prompt = f"""
-                You are a financial data extraction AI. Analyze the following bank statement text and extract all transactions.
-                
-                Rules:
-                1. Return ONLY raw JSON array. No markdown formatting.
-                2. Structure: [{{"date": "YYYY-MM-DD", "description": "Merchant/Details", "amount": 10.50, "category": "CategoryName", "type": "Paid" or "Received"}}]
-                3. "Paid" = Debits/Withdrawals, "Received" = Credits/Deposits.
-                4. Ignore non-transaction lines (headers, balances).
-                5. Guess the category (Food, Travel, Bills, Shopping, Salary, Investment, Others).
-                
-                Text Data:
-                {text[:30000]} 
-                """
-                # Limit text to avoid token limits if PDF is huge, though 1.5 Flash handles 1M tokens.
+                # 1. Local fast path: tables and known bank layouts, no API call
+                transactions, llm_pages = read_statement(blobPath(blob.path))
+                failed = 0
 
-                response = model.generate_content(prompt)
-                
-                # 4. Clean & Parse JSON
-                content = response.text.strip()
-                if content.startswith('```json'): content = content[7:-3]
-                transactions = json.loads(content)
+                # 2. Only the pages the local parser couldn't vouch for go to GenAI
+                if llm_pages:
+                    model = get_ai_model(priority=INTERACTIVE)
+                    if model is None and not transactions:
+                        flash('Server Error: GOOGLE_API_KEY missing.', 'danger')
+                        return redirect(url_for('transactions.parser'))
+                    if model is None:
+                        failed = len(llm_pages)
+                    else:
+                        # 3. Chunked extraction: overlapping chunks run concurrently, overlap rows are merged away
+                        cfg = current_app.config
+                        ai_rows, failed = extract_transactions(model, u_id, llm_pages,
+                                                               max_chars=cfg['STATEMENT_CHUNK_CHARS'],
+                                                               overlap_lines=cfg['STATEMENT_CHUNK_OVERLAP_LINES'],
+                                                               max_workers=cfg['STATEMENT_LLM_WORKERS'])
+                        transactions += ai_rows
                 
-                count = 0
-                for t in transactions:
-                    # Validate
-                    if not t.get('amount'): continue
-                    
-                    amt = float(t['amount'])
-                    raw_date = t.get('date', datetime.utcnow().strftime('%Y-%m-%d'))
-                    desc = t.get('description', 'Unknown')
-                    tran_type = t.get('type', 'Paid')
-
-                    # DUPLICATE PROTECTION: Unique Hash for Ledger Consistency
-                    hash_str = f"{u_id}-{raw_date}-{desc}-{abs(amt)}-{tran_type}"
-                    t_hash = hashlib.sha256(hash_str.encode()).hexdigest()
-
-                    # Check if exists
-                    if Expense.query.filter_by(transaction_hash=t_hash).first():
-                        continue
-
-                    new_e = Expense(
-                        user_id=u_id, 
-                        title=desc[:100], 
-                        amount=abs(amt), 
-                        category=t.get('category', 'Others'), 
-                        type=tran_type,
-                        expense_date=datetime.strptime(raw_date, '%Y-%m-%d') if raw_date else datetime.utcnow(),
-                        is_parsed=True,
-                        statement_tag=filename,
-                        transaction_hash=t_hash
-                    )
-                    db.session.add(new_e)
-                    count += 1
-                    
+                # Batched dedupe + bulk insert; a racing upload of the same statement is absorbed by ON CONFLICT
+                inserted, skipped = ingestParsedTransactions(u_id, transactions, filename)
                 db.session.commit()
-                runMonthlyEvaluation(u_id)
                 
-                # AI PRODUCTION MODULES: Batch Insight
+                # AI PRODUCTION MODULES: Batch Insight + one batched categorization pass for the 'Others' rows
                 now = datetime.utcnow()
                 generate_spending_insights(u_id, now.year, now.month)
-                # Note: For batch uploads, we don't trigger anomaly detection on every line to stay within rate limits.
-                # Real fintech apps would queue these.
+                if any(e.category == 'Others' for e in inserted):
+                    categorize_batch(u_id)
+                # Every imported row gets an indexed duplicate probe; debits are also scored against running stats
+                if inserted:
+                    detect_statement_anomalies(u_id, [e.id for e in inserted])
                 
-                flash(f'Success! AI extracted {count} transactions.', 'success')
+                flash(f'Success! Extracted {len(inserted)} new transactions ({skipped} duplicates skipped).', 'success')
+                if failed:
+                    flash(f'{failed} section(s) of the statement could not be read; re-upload to retry them.', 'warning')
 
             except Exception as e:
                 flash(f'AI Parsing Failed: {str(e)}', 'danger')
+            finally:
+                releaseBlob(blob.path)
             return redirect(url_for('transactions.parser'))
             
-    expenses = Expense.query.filter_by(user_id=u_id, is_parsed=True).order_by(Expense.expense_date.desc()).all()
-    p_paid = db.session.query(func.sum(Expense.amount)).filter_by(user_id=u_id, is_parsed=True, type='Paid').scalar() or 0
-    p_received = db.session.query(func.sum(Expense.amount)).filter_by(user_id=u_id, is_parsed=True, type='Received').scalar() or 0
-    return render_template('parser.html', expenses=expenses, p_paid=p_paid, p_received=p_received)
+    expenses, next_cursor = _expense_page(u_id, 'parsed')
+    totals = ledgerStats(u_id, Expense.is_parsed == True)["all_time"]
+    return render_template('parser.html', expenses=expenses, next_cursor=next_cursor, p_paid=totals['Paid'], p_received=totals['Received'])
 
 @bp.route('/receipts', methods=['GET', 'POST'])
 def receipts():
@@ -161,111 +161,170 @@ def receipts():
         category = request.form.get('category', 'Others')
         file = request.files.get('file')
         
-        filename = None
+        attachment = None
         if file:
-            filename = secure_filename(file.filename)
-            fpath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            file.save(fpath)
+            # Content-addressed: the expense holds one reference, dropped in delete_expense
+            attachment = storeUpload(file.stream, file.filename, file.mimetype).path
             
-        new_e = Expense(user_id=u_id, title=title, amount=amount, 
-                        category=category, attachment_url=filename)
-        db.session.add(new_e); db.session.commit()
-        runMonthlyEvaluation(u_id)
+        try:
+            new_e = Expense(user_id=u_id, title=title, amount=amount, merchant_fingerprint=merchantFingerprint(title),
+                            category=category, attachment_url=attachment)
+            db.session.add(new_e); db.session.flush()
+            applyExpenseDelta(new_e)
+            db.session.commit()
+        except Exception:
+            # No expense holds the reference, so give it back before the error propagates
+            db.session.rollback()
+            releaseBlob(attachment)
+            raise
+        detect_anomalies(u_id, new_e.id)
         flash('Receipt saved to Vault!', 'success')
         return redirect(url_for('transactions.receipts'))
             
-    images = Expense.query.filter(Expense.user_id == u_id, Expense.attachment_url != None).all()
+    images, next_cursor = _expense_page(u_id, 'receipts')
     # Map 'attachment_url' to 'attachment' for template compatibility if model changed or just use attachment_url
     for img in images:
         img.attachment = img.attachment_url # Shim for template
         
-    return render_template('receipts.html', images=images, cats=CATS)
+    return render_template('receipts.html', images=images, next_cursor=next_cursor, cats=CATS)
 
 @bp.route('/api/receipt/analyze', methods=['POST'])
 def analyze_receipt():
+    """Queues the receipt for extraction and returns 202 with a job id to poll. A file that was analyzed
+    before (same bytes, any user) is answered immediately from receipt_analyses."""
     if 'user_id' not in session: return {"error": "Unauthorized"}, 401
     
     file = request.files.get('file')
     if not file: return {"error": "No file uploaded"}, 400
+    if get_ai_model(priority=INTERACTIVE) is None: return {"error": "AI Config Missing"}, 500
     
     filename = secure_filename(file.filename)
-    fpath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-    file.save(fpath)
-    
-    api_key = os.getenv('GOOGLE_API_KEY')
-    if not api_key: return {"error": "AI Config Missing"}, 500
+    blob = storeUpload(file.stream, filename, file.mimetype)
+    done = ReceiptAnalysis.query.filter_by(sha256=blob.sha256, status='done').first()
+    if done:
+        releaseBlob(blob.path)
+        return {"success": True, "data": done.result, "filename": filename, "cached": True}
 
-    try:
-        genai.configure(api_key=api_key)
-        
-        # This model name appeared in your list_models() output
-        model_name = 'gemini-flash-latest'
-        model = genai.GenerativeModel(model_name)
-        
-        with open(fpath, "rb") as f:
-            image_data = f.read()
-            
-        mime_type = "image/jpeg"
-        if filename.lower().endswith('.pdf'): mime_type = "application/pdf"
-        elif filename.lower().endswith('.png'): mime_type = "image/png"
+    # The job takes over the blob reference and releases it when finished; it sniffs the real file type itself
+    job_id = analyze_receipt_file(session['user_id'], blob.sha256, blob.path, blob.mime_type)
+    return {"success": True, "pending": True, "job_id": str(job_id), "filename": filename,
+            "status_url": url_for('transactions.receipt_status', job_id=job_id)}, 202
 
-        prompt = """
-        You are a receipt analysis engine.
-        Extract structured financial data from this receipt.
-        Return ONLY valid JSON.
+@bp.route('/api/receipt/analyze/<uuid:job_id>')
+def receipt_status(job_id):
+    if 'user_id' not in session: return {"error": "Unauthorized"}, 401
+    job = Job.query.get(job_id)
+    if not job or job.type != analyze_receipt_file.job_type or job.payload["args"][0] != str(session['user_id']):
+        return {"error": "Not found"}, 404
 
-        {
-          "merchant": "string",
-          "total_amount": number,
-          "currency": "string",
-          "date": "YYYY-MM-DD",
-          "category": "Food/Travel/Shopping/Bills/Health/others",
-          "confidence_score": number
-        }
-        No extra text allowed.
-        """
-        
-        try:
-            response = model.generate_content([prompt, {'mime_type': mime_type, 'data': image_data}])
-            content = response.text.strip()
-            if content.startswith('```json'): content = content[7:-3]
-            if content.endswith('```'): content = content[:-3]
-            
-            data = json.loads(content)
-            return {
-                "success": True,
-                "data": data,
-                "filename": filename
-            }
-        except genai.types.BlockedPromptException as e:
-            with open("ai_error_log.txt", "a") as log:
-                log.write(f"[{datetime.utcnow()}] AI BLOCKED PROMPT ERROR: {str(e)}\n")
-            return {"success": False, "error": "AI blocked the prompt due to safety concerns."}, 400
-        except Exception as e:
-            with open("ai_error_log.txt", "a") as log:
-                log.write(f"[{datetime.utcnow()}] AI EXTRACTION ERROR: {str(e)}\n")
-            # Check for rate limit error (429) specifically
-            if "429" in str(e):
-                return {"success": False, "error": "AI service is busy. Please try again later."}, 429
-            return {"success": False, "error": "AI processing failed. Please try again later."}, 500
-    except Exception as e:
-        with open("ai_error_log.txt", "a") as f:
-            f.write(f"[{datetime.utcnow()}] AI ERROR: {str(e)}\n")
-        print(f"AI ERROR: {e}")
-        return {"success": False, "error": str(e)}, 500
+    if job.status in ('queued', 'running'):
+        return {"success": True, "status": "pending"}, 202
+    _user_id, sha256 = job.payload["args"][:2]
+    row = ReceiptAnalysis.query.get(sha256)
+    if row and row.status == 'done':
+        return {"success": True, "status": "done", "data": row.result}
+    return {"success": False, "status": "failed", "error": (row.error if row else None) or "AI processing failed. Please try again later."}
 
 @bp.route('/manual')
 def manual():
     if 'user_id' not in session: return redirect(url_for('auth.login'))
     u_id = session['user_id']
-    expenses = Expense.query.filter_by(user_id=u_id, is_parsed=False, attachment_url=None).order_by(Expense.expense_date.desc()).all()
-    m_paid = db.session.query(func.sum(Expense.amount)).filter_by(user_id=u_id, is_parsed=False, type='Paid').scalar() or 0
-    m_received = db.session.query(func.sum(Expense.amount)).filter_by(user_id=u_id, is_parsed=False, type='Received').scalar() or 0
-    cat_sum = db.session.query(Expense.category, func.sum(Expense.amount)).filter_by(user_id=u_id, is_parsed=False, type='Paid').group_by(Expense.category).all()
+    expenses, next_cursor = _expense_page(u_id, 'manual')
+    # Totals, category pie and the 7-day chart come from one aggregate statement
+    stats = ledgerStats(u_id, Expense.is_parsed == False, days=7)
+    cat_sum = [(c, t['Paid']) for c, t in stats['by_category'].items() if t['Paid']]
     
-    daily_labels, daily_values = [], []
-    for i in range(6, -1, -1):
-        d = (datetime.utcnow() - timedelta(days=i)).date()
-        amt = db.session.query(func.sum(Expense.amount)).filter_by(user_id=u_id, is_parsed=False, type='Paid').filter(func.date(Expense.expense_date) == d).scalar() or 0
-        daily_labels.append(d.strftime('%b %d')); daily_values.append(amt)
-    return render_template('manual.html', expenses=expenses, cats=CATS, pie_labels=[r[0] for r in cat_sum], pie_values=[r[1] for r in cat_sum], daily_labels=daily_labels, daily_values=daily_values, m_paid=m_paid, m_received=m_received, sel_cat='All')
+    daily_labels = [d.strftime('%b %d') for d in stats['by_day']]
+    daily_values = [t['Paid'] for t in stats['by_day'].values()]
+    return render_template('manual.html', expenses=expenses, cats=CATS, pie_labels=[r[0] for r in cat_sum], pie_values=[r[1] for r in cat_sum], daily_labels=daily_labels, daily_values=daily_values, next_cursor=next_cursor, m_paid=stats['all_time']['Paid'], m_received=stats['all_time']['Received'], sel_cat='All')
+
+@bp.route('/api/expenses')
+def list_expenses():
+    if 'user_id' not in session: return {"error": "Unauthorized"}, 401
+    view = request.args.get('view', 'manual')
+    if view not in EXPENSE_VIEWS: return {"error": f"view must be one of {', '.join(EXPENSE_VIEWS)}"}, 400
+
+    try:
+        limit = max(1, min(int(request.args.get('limit', PAGE_SIZE)), 200))
+        rows, next_cursor = _expense_page(session['user_id'], view, cursor=request.args.get('cursor'), limit=limit)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    return {"items": [_expense_json(e) for e in rows], "next_cursor": next_cursor}
+
+EXPORT_COLUMNS = ['id', 'user_id', 'expense_date', 'title', 'amount', 'category', 'type',
+                  'is_parsed', 'statement_tag', 'include_in_total']
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_BATCH = 2000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+def _export_value(v):
+    if v is None or isinstance(v, (bool, int, str)): return v
+    if isinstance(v, datetime): return v.isoformat()
+    return str(v) # Decimal, UUID
+
+def _export_lines(result, fmt):
+    """Serializes rows to text without ever holding more than one row."""
+    if fmt == 'csv':
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(EXPORT_COLUMNS)
+        yield buf.getvalue()
+        for row in result:
+            buf.seek(0); buf.truncate()
+            writer.writerow([_export_value(v) for v in row])
+            yield buf.getvalue()
+    else:
+        for row in result:
+            yield json.dumps(dict(zip(EXPORT_COLUMNS, (_export_value(v) for v in row))), ensure_ascii=False) + "\n"
+
+def _export_stream(stmt, fmt, compress):
+    # yield_per streams from a server-side cursor, so memory stays flat regardless of row count
+    result = db.session.execute(stmt.execution_options(yield_per=EXPORT_BATCH))
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    pending, size = [], 0
+    try:
+        for line in _export_lines(result, fmt):
+            pending.append(line); size += len(line)
+            if size >= EXPORT_CHUNK_BYTES:
+                data = "".join(pending).encode()
+                pending, size = [], 0
+                data = gz.compress(data) if gz else data
+                if data: yield data
+        data = "".join(pending).encode()
+        if gz: data = gz.compress(data) + gz.flush()
+        if data: yield data
+    finally:
+        result.close()
+
+@bp.route('/api/export')
+def export_expenses():
+    """Streams the ledger as CSV or NDJSON (optionally gzipped). Admins can pass scope=all for every user."""
+    if 'user_id' not in session: return {"error": "Unauthorized"}, 401
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS: return {"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}, 400
+
+    criteria = []
+    if request.args.get('scope') == 'all':
+        user = User.query.get(session['user_id'])
+        if not user or user.role != UserRole.ADMIN: return {"error": "Forbidden"}, 403
+    else:
+        criteria.append(Expense.user_id == session['user_id'])
+
+    try:
+        start = datetime.strptime(request.args['from'], '%Y-%m-%d') if request.args.get('from') else None
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d') + timedelta(days=1) if request.args.get('to') else None
+    except ValueError:
+        return {"error": "from/to must be YYYY-MM-DD"}, 400
+    if start and end: criteria.append(inPeriod((start, end)))
+    elif start: criteria.append(Expense.expense_date >= start)
+    elif end: criteria.append(Expense.expense_date < end)
+    if request.args.get('category'): criteria.append(Expense.category == request.args['category'])
+
+    stmt = db.select(*[getattr(Expense, c) for c in EXPORT_COLUMNS]).where(*criteria) \
+        .order_by(Expense.expense_date, Expense.id)
+
+    compress = request.args.get('gzip') in ('1', 'true')
+    filename = f"expenses_{datetime.utcnow().strftime('%Y%m%d')}.{fmt}" + (".gz" if compress else "")
+    mimetype = 'application/gzip' if compress else EXPORT_FORMATS[fmt]
+    return Response(stream_with_context(_export_stream(stmt, fmt, compress)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
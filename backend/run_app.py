@@ -6,9 +6,13 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from backend import create_app
 from backend.extensions import db
 from backend import models
+from backend.utils import startSummaryWorker
+from backend.jobs import JobWorker
 
 app = create_app()
 
+# Background loops never start on import (one copy per gunicorn worker); under gunicorn run backend/run_worker.py.
+
 if __name__ == '__main__':
     with app.app_context():
         # Ideally use Flask-Migrate for production
@@ -17,5 +21,12 @@ if __name__ == '__main__':
         upload_folder = app.config['UPLOAD_FOLDER']
         if not os.path.exists(upload_folder):
             os.makedirs(upload_folder)
+
+    # Single-process dev convenience; the reloader's parent process only watches files, so skip it there
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        if app.config.get('SUMMARY_WORKER_IN_APP'):
+            startSummaryWorker(app)
+        if app.config.get('JOB_WORKER_IN_APP'):
+            JobWorker(app).start()
             
     app.run(debug=True)
@@ -0,0 +1,29 @@
+import sys
+import os
+import signal
+# Add the root directory to sys.path to resolve backend package
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from backend import create_app
+from backend import utils  # registers the job types
+from backend.utils import startSummaryWorker
+from backend.jobs import JobWorker
+
+# Background worker: python backend/run_worker.py
+# Runs the job pool and the MonthlySummary recompute loop. Any number of these can run side by side:
+# jobs are claimed with compare-and-set and dirty months with SKIP LOCKED / CAS.
+app = create_app()
+worker = JobWorker(app)
+
+def shutdown(signum, frame):
+    print("Stopping job worker, waiting for in-flight jobs...")
+    worker._stop.set()
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    if app.config.get('SUMMARY_WORKER_ENABLED'):
+        startSummaryWorker(app)
+    print(f"Job worker {worker.worker_id} with {worker.workers} threads")
+    worker.run_forever()
+    worker.stop(wait=True)
@@ -0,0 +1,42 @@
+import sys
+import os
+import glob
+import time
+import argparse
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from backend.config import Config
+from backend.receipt_images import compactReceipt, sniffMimeType
+
+# Size and time of the receipt compaction step on sample files (what analyze_receipt_file sends to the model).
+# Usage: python backend/scripts/benchmark_receipt_compaction.py [files...] [--max-dim 1600] [--quality 80] [--repeat 5]
+
+LOGS = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'logs'))
+
+parser = argparse.ArgumentParser(description="Benchmark receipt compaction.")
+parser.add_argument('files', nargs='*', help="Receipt images/PDFs (default: receipts in backend/logs)")
+parser.add_argument('--max-dim', type=int, default=Config.RECEIPT_MAX_DIM)
+parser.add_argument('--quality', type=int, default=Config.RECEIPT_JPEG_QUALITY)
+parser.add_argument('--pdf-pages', type=int, default=Config.RECEIPT_PDF_PAGES)
+parser.add_argument('--repeat', type=int, default=5)
+args = parser.parse_args()
+
+files = args.files or sorted(f for ext in ('jpg', 'jpeg', 'png', 'webp', 'pdf') for f in glob.glob(os.path.join(LOGS, f'*.{ext}')))
+if not files:
+    sys.exit(f"No sample receipts found in {LOGS}")
+
+total_in = total_out = 0
+print(f"{'file':40} {'type':16} {'original':>10} {'sent':>10} {'ratio':>6} {'size':>11} {'ms':>7}")
+for path in files:
+    with open(path, 'rb') as f:
+        data = f.read()
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        result = compactReceipt(data, None, args.max_dim, args.quality, args.pdf_pages)
+    ms = (time.perf_counter() - started) * 1000 / args.repeat
+    total_in += result.original_bytes; total_out += result.compacted_bytes
+    dims = f"{result.width}x{result.height}" if result.width else "-"
+    print(f"{os.path.basename(path)[:40]:40} {sniffMimeType(data[:16]) or '?':16} {result.original_bytes:>10,} "
+          f"{result.compacted_bytes:>10,} {result.compacted_bytes / result.original_bytes:>6.2f} {dims:>11} {ms:>7.1f}")
+
+print(f"Total: {total_in:,} -> {total_out:,} bytes ({total_out / total_in:.2f}x) at max_dim={args.max_dim}, quality={args.quality}")
@@ -0,0 +1,48 @@
+import sys
+import os
+import time
+import argparse
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from sqlalchemy import text
+from backend import create_app
+from backend.extensions import db
+
+# Per-task setup cost of background work: the old create_app() per task versus the shared worker app
+# (app context + scoped session per task). Each task runs one trivial query so connection handling is included.
+# Usage: python backend/scripts/benchmark_task_overhead.py [--tasks 50]
+
+def task():
+    db.session.execute(text("SELECT 1")).scalar()
+
+def per_task_app(n):
+    engines = set()
+    started = time.perf_counter()
+    for _ in range(n):
+        app = create_app()
+        with app.app_context():
+            task()
+            engines.add(id(db.engine))
+            db.session.remove()
+    return time.perf_counter() - started, len(engines)
+
+def shared_app(n):
+    app = create_app()
+    engines = set()
+    started = time.perf_counter()
+    for _ in range(n):
+        with app.app_context():
+            task()
+            engines.add(id(db.engine))
+            db.session.remove()
+    return time.perf_counter() - started, len(engines)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark per-task overhead of background job setup.")
+    parser.add_argument('--tasks', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"--- Background task overhead ({args.tasks} tasks) ---")
+    for name, run in (("create_app() per task", per_task_app), ("shared worker app", shared_app)):
+        elapsed, engines = run(args.tasks)
+        print(f"{name:<24} {elapsed / args.tasks * 1000:8.2f} ms/task  engines/pools created: {engines}")
@@ -0,0 +1,20 @@
+from backend import create_app
+from backend.extensions import db
+from sqlalchemy import text
+
+app = create_app()
+with app.app_context():
+    alterations = [
+        # Coalescing of identical queued jobs (batched categorization window)
+        "ALTER TABLE jobs ADD COLUMN IF NOT EXISTS dedupe_key VARCHAR(40)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs (type, dedupe_key, status)"
+    ]
+    
+    for sql in alterations:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+            print(f"Executed OK: {sql[:50]}...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Skipped/Error: {sql[:50]}... | {e}")
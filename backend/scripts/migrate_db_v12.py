@@ -0,0 +1,19 @@
+from backend import create_app
+from backend.extensions import db
+from sqlalchemy import text
+
+app = create_app()
+with app.app_context():
+    alterations = [
+        # Fingerprint of the inputs an AI report was generated from
+        "ALTER TABLE ai_reports ADD COLUMN IF NOT EXISTS snapshot_fingerprint VARCHAR(64)"
+    ]
+    
+    for sql in alterations:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+            print(f"Executed OK: {sql[:50]}...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Skipped/Error: {sql[:50]}... | {e}")
@@ -0,0 +1,28 @@
+from backend import create_app
+from backend.extensions import db
+from sqlalchemy import text
+
+app = create_app()
+with app.app_context():
+    alterations = [
+        """
+        CREATE TABLE IF NOT EXISTS spending_stats (
+            user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            category VARCHAR(50) NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            mean DOUBLE PRECISION NOT NULL DEFAULT 0,
+            m2 DOUBLE PRECISION NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, category)
+        )
+        """
+    ]
+    
+    for sql in alterations:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+            print(f"Executed OK: {sql[:50]}...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Skipped/Error: {sql[:50]}... | {e}")
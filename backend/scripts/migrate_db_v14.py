@@ -0,0 +1,23 @@
+from backend import create_app
+from backend.extensions import db
+from sqlalchemy import text
+
+app = create_app()
+with app.app_context():
+    alterations = [
+        # Keep the oldest warning per (expense, type) so the unique index can be built
+        """
+        DELETE FROM anomaly_warnings a USING anomaly_warnings b
+        WHERE a.expense_id = b.expense_id AND a.type = b.type AND a.ctid > b.ctid
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_anomaly_warnings_expense_type ON anomaly_warnings (expense_id, type)"
+    ]
+    
+    for sql in alterations:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+            print(f"Executed OK: {sql[:50]}...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Skipped/Error: {sql[:50]}... | {e}")
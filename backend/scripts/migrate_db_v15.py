@@ -0,0 +1,35 @@
+from backend import create_app
+from backend.extensions import db
+from backend.models import Expense
+from backend.utils import merchantFingerprint
+from sqlalchemy import text, case
+
+app = create_app()
+with app.app_context():
+    alterations = [
+        # Normalized merchant key for fuzzy duplicate-charge checks
+        "ALTER TABLE expenses ADD COLUMN IF NOT EXISTS merchant_fingerprint VARCHAR(64)",
+        "CREATE INDEX IF NOT EXISTS idx_expenses_duplicate ON expenses (user_id, amount, merchant_fingerprint, expense_date)"
+    ]
+    
+    for sql in alterations:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+            print(f"Executed OK: {sql[:50]}...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Skipped/Error: {sql[:50]}... | {e}")
+
+    # Backfill existing rows in batches
+    filled = 0
+    while True:
+        rows = db.session.query(Expense.id, Expense.title).filter(Expense.merchant_fingerprint.is_(None)).limit(5000).all()
+        if not rows: break
+        fingerprints = {r.id: merchantFingerprint(r.title) for r in rows}
+        db.session.execute(Expense.__table__.update()
+                           .where(Expense.id.in_(list(fingerprints)))
+                           .values(merchant_fingerprint=case(fingerprints, value=Expense.id)))
+        db.session.commit()
+        filled += len(rows)
+        print(f"Backfilled {filled} fingerprints...")
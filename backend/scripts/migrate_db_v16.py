@@ -0,0 +1,29 @@
+from backend import create_app
+from backend.extensions import db
+from sqlalchemy import text
+
+app = create_app()
+with app.app_context():
+    alterations = [
+        # Refcounted, content-addressed upload storage (blob_store.py)
+        """
+        CREATE TABLE IF NOT EXISTS stored_blobs (
+            sha256 VARCHAR(64) PRIMARY KEY,
+            path VARCHAR(255) NOT NULL UNIQUE,
+            size BIGINT NOT NULL,
+            mime_type VARCHAR(100),
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    ]
+    
+    for sql in alterations:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+            print(f"Executed OK: {sql[:50]}...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Skipped/Error: {sql[:50]}... | {e}")
@@ -0,0 +1,28 @@
+from backend import create_app
+from backend.extensions import db
+from sqlalchemy import text
+
+app = create_app()
+with app.app_context():
+    alterations = [
+        # Receipt extraction results keyed by file hash (async /api/receipt/analyze)
+        """
+        CREATE TABLE IF NOT EXISTS receipt_analyses (
+            sha256 VARCHAR(64) PRIMARY KEY,
+            status VARCHAR(20) NOT NULL DEFAULT 'done',
+            result JSONB,
+            error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    ]
+    
+    for sql in alterations:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+            print(f"Executed OK: {sql[:50]}...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Skipped/Error: {sql[:50]}... | {e}")
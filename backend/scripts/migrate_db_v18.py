@@ -0,0 +1,20 @@
+from backend import create_app
+from backend.extensions import db
+from sqlalchemy import text
+
+app = create_app()
+with app.app_context():
+    alterations = [
+        # Upload size vs. the compacted image actually sent to the model
+        "ALTER TABLE receipt_analyses ADD COLUMN IF NOT EXISTS original_bytes BIGINT",
+        "ALTER TABLE receipt_analyses ADD COLUMN IF NOT EXISTS compacted_bytes BIGINT"
+    ]
+    
+    for sql in alterations:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+            print(f"Executed OK: {sql[:50]}...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Skipped/Error: {sql[:50]}... | {e}")
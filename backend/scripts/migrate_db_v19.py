@@ -0,0 +1,25 @@
+from backend import create_app
+from backend.extensions import db
+from sqlalchemy import text
+
+app = create_app()
+with app.app_context():
+    alterations = [
+        # Keep one queued job per dedupe key before the unique index goes on
+        """DELETE FROM jobs WHERE status = 'queued' AND dedupe_key IS NOT NULL AND id NOT IN (
+               SELECT DISTINCT ON (type, dedupe_key) id FROM jobs
+               WHERE status = 'queued' AND dedupe_key IS NOT NULL
+               ORDER BY type, dedupe_key, run_after)""",
+        "DROP INDEX IF EXISTS idx_jobs_dedupe",
+        # enqueue() inserts dedupe jobs with ON CONFLICT DO NOTHING against this index
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_jobs_dedupe_queued ON jobs (type, dedupe_key) WHERE status = 'queued'"
+    ]
+
+    for sql in alterations:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+            print(f"Executed OK: {sql[:50]}...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Skipped/Error: {sql[:50]}... | {e}")
@@ -0,0 +1,29 @@
+from backend import create_app
+from backend.extensions import db
+from backend.utils import reconcileLedgerTotals
+from sqlalchemy import text
+
+app = create_app()
+with app.app_context():
+    alterations = [
+        """
+        CREATE TABLE IF NOT EXISTS user_ledger_totals (
+            user_id UUID PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+            total_income NUMERIC(15, 2) NOT NULL DEFAULT 0.00,
+            total_expenses NUMERIC(15, 2) NOT NULL DEFAULT 0.00,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    ]
+    
+    for sql in alterations:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+            print(f"Executed OK: {sql[:50]}...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Skipped/Error: {sql[:50]}... | {e}")
+
+    # Backfill running totals for existing users
+    print(f"Backfilled {len(reconcileLedgerTotals(repair=True))} ledger totals rows.")
@@ -0,0 +1,32 @@
+from backend import create_app
+from backend.extensions import db
+from backend.utils import rebuildDailyRollups
+from sqlalchemy import text
+
+app = create_app()
+with app.app_context():
+    alterations = [
+        """
+        CREATE TABLE IF NOT EXISTS daily_expense_rollups (
+            user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            day DATE NOT NULL,
+            category VARCHAR(50) NOT NULL,
+            type VARCHAR(20) NOT NULL,
+            total_amount NUMERIC(15, 2) NOT NULL DEFAULT 0.00,
+            txn_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, category, type)
+        )
+        """
+    ]
+    
+    for sql in alterations:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+            print(f"Executed OK: {sql[:50]}...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Skipped/Error: {sql[:50]}... | {e}")
+
+    # Backfill from the existing ledger
+    print(f"Backfilled {rebuildDailyRollups()} daily rollup rows.")
@@ -0,0 +1,19 @@
+from backend import create_app
+from backend.extensions import db
+from sqlalchemy import text
+
+app = create_app()
+with app.app_context():
+    alterations = [
+        # Keyset pagination of open anomaly warnings
+        "CREATE INDEX IF NOT EXISTS idx_anomaly_warnings_user_open ON anomaly_warnings (user_id, is_resolved, created_at DESC)"
+    ]
+    
+    for sql in alterations:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+            print(f"Executed OK: {sql[:50]}...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Skipped/Error: {sql[:50]}... | {e}")
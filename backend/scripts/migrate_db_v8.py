@@ -0,0 +1,36 @@
+from backend import create_app
+from backend.extensions import db
+from sqlalchemy import text
+
+app = create_app()
+with app.app_context():
+    alterations = [
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id UUID PRIMARY KEY,
+            type VARCHAR(50) NOT NULL,
+            payload JSONB DEFAULT '{}'::jsonb,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            run_after TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            locked_by VARCHAR(100),
+            locked_at TIMESTAMP WITH TIME ZONE,
+            last_error TEXT,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Dispatcher: due queued jobs; per-type running counts
+        "CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs (status, run_after)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_type_status ON jobs (type, status)"
+    ]
+    
+    for sql in alterations:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+            print(f"Executed OK: {sql[:50]}...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Skipped/Error: {sql[:50]}... | {e}")
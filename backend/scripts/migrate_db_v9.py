@@ -0,0 +1,31 @@
+from backend import create_app
+from backend.extensions import db
+from sqlalchemy import text
+
+app = create_app()
+with app.app_context():
+    alterations = [
+        """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key VARCHAR(64) PRIMARY KEY,
+            model VARCHAR(100) NOT NULL,
+            response TEXT NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_hit_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+        )
+        """,
+        # TTL sweep and least-recently-hit eviction
+        "CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache (expires_at)",
+        "CREATE INDEX IF NOT EXISTS idx_llm_cache_last_hit ON llm_cache (last_hit_at)"
+    ]
+    
+    for sql in alterations:
+        try:
+            db.session.execute(text(sql))
+            db.session.commit()
+            print(f"Executed OK: {sql[:50]}...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Skipped/Error: {sql[:50]}... | {e}")
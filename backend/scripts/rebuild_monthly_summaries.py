@@ -0,0 +1,58 @@
+import sys
+import os
+import time
+import uuid
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+# Rebuilds monthly_summaries for every user and closes a month (goal_status ACHIEVED/NOT_ACHIEVED)
+# without waiting for users to log in. Work is fanned out over a process pool by user-id range.
+# Usage: python backend/scripts/rebuild_monthly_summaries.py [--close YYYY-MM] [--workers 4] [--partitions 16]
+
+def user_id_ranges(partitions):
+    """Splits the UUID space into contiguous [lo, hi) ranges; the last range is open-ended."""
+    step = (1 << 128) // partitions
+    bounds = [uuid.UUID(int=i * step) for i in range(partitions)] + [None]
+    return [(bounds[i] if i else None, bounds[i + 1]) for i in range(partitions)]
+
+def rebuild_range(lo, hi, close, batch_size):
+    # Each process gets its own app, engine and connection pool
+    from backend import create_app
+    from backend.utils import rebuildMonthlySummaries
+    app = create_app()
+    with app.app_context():
+        return rebuildMonthlySummaries(lo=lo, hi=hi, close=close, batch_size=batch_size)
+
+def main():
+    prev = datetime.utcnow().replace(day=1) - timedelta(days=1)
+    parser = argparse.ArgumentParser(description="Bulk rebuild of monthly summaries with month close.")
+    parser.add_argument('--close', default=f"{prev.year}-{prev.month:02d}", help="Month to close for all users (YYYY-MM, default: previous month)")
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--partitions', type=int, help="User-id ranges to split into (default: 4 per worker)")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    close = tuple(int(p) for p in args.close.split('-'))
+    ranges = user_id_ranges(args.partitions or args.workers * 4)
+    print(f"Rebuilding across {len(ranges)} user-id ranges with {args.workers} workers, closing {close[0]}-{close[1]:02d}")
+
+    started = time.perf_counter()
+    users = rows = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(rebuild_range, lo, hi, close, args.batch_size): (lo, hi) for lo, hi in ranges}
+        for future in as_completed(futures):
+            lo, hi = futures[future]
+            stats = future.result()
+            users += stats["users"]; rows += stats["rows"]
+            rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0
+            print(f"  [{str(lo or '')[:8]:>8} .. {str(hi or '')[:8]:<8}] users={stats['users']} rows={stats['rows']} "
+                  f"in {stats['seconds']:.2f}s ({rate:,.0f} rows/s)")
+
+    elapsed = time.perf_counter() - started
+    print(f"Done: {users} users, {rows} summaries in {elapsed:.2f}s "
+          f"({rows / elapsed if elapsed else 0:,.0f} rows/s, {users / elapsed if elapsed else 0:,.0f} users/s)")
+
+if __name__ == '__main__':
+    main()
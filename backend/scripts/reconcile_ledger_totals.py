@@ -0,0 +1,24 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from backend import create_app
+from backend.utils import reconcileLedgerTotals
+
+# Detects drift between user_ledger_totals and the raw expenses ledger.
+# Usage: python backend/scripts/reconcile_ledger_totals.py [--user <uuid>] [--repair]
+parser = argparse.ArgumentParser(description="Reconcile per-user running ledger totals against the expenses table.")
+parser.add_argument('--user', help="Only reconcile this user id")
+parser.add_argument('--repair', action='store_true', help="Rewrite drifted or missing totals rows")
+args = parser.parse_args()
+
+app = create_app()
+with app.app_context():
+    drifted = reconcileLedgerTotals(user_id=args.user, repair=args.repair)
+    for user_id, stored, actual in drifted:
+        stored_txt = f"income={stored[0]} expenses={stored[1]}" if stored else "missing"
+        print(f"{user_id} | stored {stored_txt} | ledger income={actual[0]} expenses={actual[1]}")
+
+    action = "Repaired" if args.repair else "Found"
+    print(f"{action} {len(drifted)} drifted ledger totals.")
@@ -0,0 +1,28 @@
+import sys
+import os
+import argparse
+from datetime import datetime
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from backend import create_app
+from backend.anomaly_scan import scanAnomalies
+
+# Offline anomaly scan over every user's ledger (robust z-scores, 90-day spikes, duplicate clusters).
+# Safe to re-run: warnings are unique per (expense, type).
+# Usage: python backend/scripts/scan_anomalies.py [--since YYYY-MM-DD] [--chunk-rows 200000]
+parser = argparse.ArgumentParser(description="Vectorized anomaly scan across all ledgers.")
+parser.add_argument('--since', help="Only flag expenses created on/after this date (history still feeds the baselines)")
+parser.add_argument('--chunk-rows', type=int, default=200000)
+args = parser.parse_args()
+
+since = datetime.strptime(args.since, '%Y-%m-%d') if args.since else None
+
+def progress(stats):
+    print(f"  rows={stats['rows']:,} users={stats['users']:,} warnings={stats['warnings']:,} new={stats['inserted']:,}")
+
+app = create_app()
+with app.app_context():
+    stats = scanAnomalies(since=since, chunk_rows=args.chunk_rows, progress=progress)
+    rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0
+    print(f"Scanned {stats['rows']:,} expenses for {stats['users']:,} users in {stats['seconds']:.2f}s ({rate:,.0f} rows/s); "
+          f"{stats['inserted']:,} new warnings ({stats['warnings']:,} found).")
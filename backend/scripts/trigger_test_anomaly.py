@@ -20,8 +20,8 @@ with app.app_context():
         db.session.add(anomaly)
         db.session.commit()
         
-        # 3. Trigger detector
-        detect_anomalies(u.id, anomaly.id)
+        # 3. Trigger detector (inline, no worker needed)
+        detect_anomalies.run(u.id, anomaly.id)
         runMonthlyEvaluation(u.id)
         
         print(f"Anomaly triggered for user {u.email}")
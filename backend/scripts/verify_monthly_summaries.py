@@ -0,0 +1,24 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from backend import create_app
+from backend.utils import verifyMonthlySummaries
+
+# Full-recompute check for the delta-maintained monthly_summaries.
+# Usage: python backend/scripts/verify_monthly_summaries.py [--user <uuid>] [--repair]
+parser = argparse.ArgumentParser(description="Verify (and optionally repair) monthly summaries against the raw ledger.")
+parser.add_argument('--user', help="Only check this user id")
+parser.add_argument('--repair', action='store_true', help="Overwrite drifted rows with recomputed values")
+args = parser.parse_args()
+
+app = create_app()
+with app.app_context():
+    drifted = verifyMonthlySummaries(user_id=args.user, repair=args.repair)
+    for user_id, year, month, diff in drifted:
+        changes = ", ".join(f"{f}: {old} -> {new}" for f, (old, new) in diff.items())
+        print(f"{user_id} {year}-{month:02d} | {changes}")
+
+    action = "Repaired" if args.repair else "Found"
+    print(f"{action} {len(drifted)} drifted summaries.")
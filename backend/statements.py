@@ -0,0 +1,289 @@
+import re
+import json
+from collections import namedtuple
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import pdfplumber
+from flask import current_app, has_app_context
+from .utils import transactionHash
+from .llm_cache import cachedGenerate
+
+# --- BANK STATEMENT EXTRACTION PIPELINE ---
+# PDF pages -> overlapping chunks on page/row boundaries -> concurrent LLM calls -> merged, deduped rows
+
+STATEMENT_PROMPT = """
+You are a financial data extraction AI. Analyze the following bank statement text and extract all transactions.
+
+Rules:
+1. Return ONLY raw JSON array. No markdown formatting.
+2. Structure: [{{"date": "YYYY-MM-DD", "description": "Merchant/Details", "amount": 10.50, "category": "CategoryName", "type": "Paid" or "Received"}}]
+3. "Paid" = Debits/Withdrawals, "Received" = Credits/Deposits.
+4. Ignore non-transaction lines (headers, balances).
+5. Guess the category (Food, Travel, Bills, Shopping, Salary, Investment, Others).
+6. The text may start or end mid-statement; skip partial rows cut off at the edges.
+
+Text Data:
+{text}
+"""
+
+def _splitLine(line, limit):
+    """Hard-splits a line longer than `limit` into pieces of at most `limit`, breaking at spaces where possible."""
+    pieces = []
+    while len(line) > limit:
+        cut = line.rfind(' ', 0, limit + 1)
+        if cut <= 0: cut = limit
+        pieces.append(line[:cut])
+        line = line[cut:].lstrip()
+    if line: pieces.append(line)
+    return pieces
+
+def chunk_pages(pages, max_chars=12000, overlap_lines=3):
+    """Packs pages into chunks of at most ~max_chars. Whole pages stay together when they fit (keeping
+    table headers with their rows); oversized pages are split on line (row) boundaries, and a single line too
+    long to share a chunk (text extracted without line breaks) is hard-split. Each chunk repeats the last
+    `overlap_lines` rows of the previous one so a transaction straddling a boundary is seen whole at least
+    once; the repeats are removed again by hash on merge."""
+    chunks, current, size, fresh = [], [], 0, 0
+    limit = max(1, max_chars // 2)  # longest line kept whole, and the most the carried overlap may take up
+
+    def close():
+        chunks.append("\n".join(current))
+        carry = current[-overlap_lines:] if overlap_lines else []
+        while carry and sum(len(l) + 1 for l in carry) > limit: carry = carry[1:]
+        return carry, sum(len(l) + 1 for l in carry), 0
+
+    for page in pages:
+        page_lines = [piece for l in page.splitlines() if l.strip() for piece in _splitLine(l, limit)]
+        page_size = sum(len(l) + 1 for l in page_lines)
+        if fresh and size + page_size > max_chars:
+            current, size, fresh = close()
+        for line in page_lines:
+            if fresh and size + len(line) + 1 > max_chars:
+                current, size, fresh = close()
+            current.append(line)
+            size += len(line) + 1
+            fresh += 1
+    if fresh:
+        chunks.append("\n".join(current))
+    return chunks
+
+def parse_model_json(content):
+    content = content.strip()
+    if content.startswith('```json'): content = content[7:]
+    elif content.startswith('```'): content = content[3:]
+    if content.endswith('```'): content = content[:-3]
+    return json.loads(content.strip())
+
+def extract_chunk(model, text):
+    rows = parse_model_json(cachedGenerate(model, STATEMENT_PROMPT.format(text=text)))
+    return rows if isinstance(rows, list) else []
+
+def merge_transactions(user_id, results):
+    """Flattens per-chunk results, dropping rows repeated by chunk overlap (same transaction_hash)."""
+    merged, seen = [], set()
+    for rows in results:
+        for t in rows:
+            if not isinstance(t, dict) or not t.get('amount'): continue
+            try:
+                key = transactionHash(user_id, t.get('date'), t.get('description', 'Unknown'), float(t['amount']), t.get('type', 'Paid'))
+            except (TypeError, ValueError):
+                continue
+            if key in seen: continue
+            seen.add(key)
+            merged.append(t)
+    return merged
+
+def extract_transactions(model, user_id, pages, max_chars=12000, overlap_lines=3, max_workers=4):
+    """Runs the chunks through a bounded thread pool so latency tracks the slowest chunk.
+    Returns (transactions, failed_chunks); raises only if every chunk failed."""
+    chunks = chunk_pages(pages, max_chars=max_chars, overlap_lines=overlap_lines)
+    if not chunks: return [], 0
+
+    # Pool threads borrow the request's app so the shared LLM cache table is reachable
+    app = current_app._get_current_object() if has_app_context() else None
+
+    def run(text):
+        try:
+            with app.app_context() if app else nullcontext():
+                return extract_chunk(model, text), None
+        except Exception as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as pool:
+        outcomes = list(pool.map(run, chunks))
+
+    results = [rows for rows, err in outcomes if err is None]
+    errors = [err for _, err in outcomes if err is not None]
+    if not results:
+        raise errors[0]
+    return merge_transactions(user_id, results), len(errors)
+
+# --- LOCAL EXTRACTORS ---
+# Deterministic fast path: pdfplumber tables first, then per-bank line templates. A page is only trusted when
+# every transaction-looking line on it was parsed; anything else is handed to the LLM pipeline above.
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%d/%m/%y', '%d-%m-%y',
+                '%d %b %Y', '%d-%b-%Y', '%d %b %y', '%d-%b-%y', '%d %B %Y')
+DATE_TOKEN = r'(?:\d{4}-\d{2}-\d{2}|\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{1,2}[ -][A-Za-z]{3,9}[ -]\d{2,4})'
+AMOUNT_TOKEN = r'[\d,]+\.\d{2}'
+CANDIDATE_LINE = re.compile(r'^\s*' + DATE_TOKEN + r'\b.*\d\.\d{2}')
+MONEY = re.compile(r'\d\.\d{2}\b')
+# Amount-bearing lines that are known not to be transactions: balances, totals and dues from statement summaries
+SUMMARY_LINE = re.compile(r'\b(?:(?:opening|closing|available|ledger|total)\s+balance|balance\s+(?:b/f|c/f|brought|carried)'
+                          r'|total\s+(?:debits?|credits?|withdrawals?|deposits?|amount\s+due|due)|(?:minimum|min)\s+(?:amount\s+)?due'
+                          r'|credit\s+limit|(?:statement|account)\s+summary)\b', re.I)
+
+# name: label for logs; detect: regex that must appear somewhere in the statement text for the template to be
+# tried; row: regex with named groups date, description, amount and one of drcr / sign that decides the type.
+StatementTemplate = namedtuple('StatementTemplate', 'name detect row')
+
+TEMPLATES = [
+    # "01/10/2026  UPI/SWIGGY/Order 1234   250.00 Dr   9,750.00 Cr"
+    StatementTemplate('drcr_suffix', re.compile(r'\b(?:Dr|DR|Cr|CR)\b'),
+                      re.compile(r'^\s*(?P<date>' + DATE_TOKEN + r')\s+(?P<description>.+?)\s+(?P<amount>' + AMOUNT_TOKEN
+                                 + r')\s*(?P<drcr>Dr|DR|Cr|CR)\b(?:\s+' + AMOUNT_TOKEN + r'(?:\s*(?:Dr|DR|Cr|CR))?)?\s*$')),
+    # "2026-10-01  SWIGGY BANGALORE   -250.00   9,750.00"
+    StatementTemplate('signed_amount', re.compile(r'(?:^|\s)[-+]' + AMOUNT_TOKEN, re.M),
+                      re.compile(r'^\s*(?P<date>' + DATE_TOKEN + r')\s+(?P<description>.+?)\s+(?P<sign>[-+])\s?(?P<amount>'
+                                 + AMOUNT_TOKEN + r')(?:\s+-?' + AMOUNT_TOKEN + r')?\s*$')),
+]
+
+def register_template(template):
+    """Adds a bank layout; later registrations are tried first so specific formats win over generic ones."""
+    TEMPLATES.insert(0, template)
+
+HEADER_ROLES = {
+    'date': ('date', 'txn date', 'tran date', 'transaction date', 'posting date', 'value date'),
+    'description': ('description', 'narration', 'particulars', 'details', 'transaction details', 'remarks'),
+    'debit': ('debit', 'debits', 'withdrawal', 'withdrawals', 'withdrawal amt', 'withdrawal amount', 'debit amount', 'dr'),
+    'credit': ('credit', 'credits', 'deposit', 'deposits', 'deposit amt', 'deposit amount', 'credit amount', 'cr'),
+    'amount': ('amount', 'transaction amount', 'amount (inr)'),
+    'drcr': ('dr/cr', 'cr/dr', 'type', 'txn type'),
+}
+
+def parse_date(value):
+    value = (value or '').strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+def parse_amount(value):
+    value = (value or '').replace(',', '').strip()
+    if not value: return None
+    try:
+        return abs(float(value))
+    except ValueError:
+        return None
+
+def _drcrType(value):
+    value = (value or '').strip().lower()
+    if value.startswith('dr') or value.startswith('debit'): return 'Paid'
+    if value.startswith('cr') or value.startswith('credit'): return 'Received'
+    return None
+
+def _headerMap(row):
+    """Column index per role, or None if this row isn't a usable header."""
+    cols = {}
+    for i, cell in enumerate(row):
+        label = ' '.join((cell or '').lower().replace('.', '').split())
+        for role, names in HEADER_ROLES.items():
+            if label in names and role not in cols:
+                cols[role] = i
+                break
+    has_type = 'debit' in cols or 'credit' in cols or ('amount' in cols and 'drcr' in cols)
+    return cols if 'date' in cols and 'description' in cols and has_type else None
+
+def _tableRow(row, cols):
+    """Returns a transaction dict, 'continuation' for a wrapped narration line, or None if unparseable."""
+    cell = lambda role: row[cols[role]] if role in cols and cols[role] < len(row) else None
+    date = parse_date(cell('date'))
+    desc = ' '.join((cell('description') or '').split())
+    if not date:
+        return 'continuation' if desc and not any(parse_amount(cell(r)) for r in ('debit', 'credit', 'amount')) else None
+    debit, credit = parse_amount(cell('debit')), parse_amount(cell('credit'))
+    if debit and not credit:
+        amount, tran_type = debit, 'Paid'
+    elif credit and not debit:
+        amount, tran_type = credit, 'Received'
+    else:
+        amount, tran_type = parse_amount(cell('amount')), _drcrType(cell('drcr'))
+    if not amount or not tran_type: return None
+    return {"date": date, "description": desc or 'Unknown', "amount": amount, "type": tran_type}
+
+def parse_tables(tables, cols=None):
+    """Parses pdfplumber tables. `cols` carries the header mapping over from the previous page for tables
+    that continue without repeating their header. Returns (rows, unparsed, cols)."""
+    rows, unparsed = [], 0
+    for table in tables:
+        for raw in table:
+            header = _headerMap(raw)
+            if header:
+                cols = header
+                continue
+            if not cols or not any(c and c.strip() for c in raw): continue
+            parsed = _tableRow(raw, cols)
+            if parsed == 'continuation':
+                if rows: rows[-1]["description"] = f"{rows[-1]['description']} {' '.join(raw[cols['description']].split())}"
+            elif parsed:
+                rows.append(parsed)
+            elif parse_date(raw[cols['date']] if cols['date'] < len(raw) else None):
+                unparsed += 1
+    return rows, unparsed, cols
+
+def parse_lines(text, templates):
+    """Matches every transaction-looking line against the templates. Returns (rows, unparsed)."""
+    rows, unparsed = [], 0
+    for line in text.splitlines():
+        if not CANDIDATE_LINE.match(line): continue
+        for template in templates:
+            m = template.row.match(line)
+            if not m: continue
+            date = parse_date(m.group('date'))
+            groups = m.groupdict()
+            tran_type = _drcrType(groups['drcr']) if groups.get('drcr') else \
+                ('Paid' if groups.get('sign') == '-' else 'Received') if groups.get('sign') else None
+            amount = parse_amount(m.group('amount'))
+            if date and amount and tran_type:
+                rows.append({"date": date, "description": ' '.join(m.group('description').split()), "amount": amount, "type": tran_type})
+                break
+        else:
+            unparsed += 1
+    return rows, unparsed
+
+def _summaryPage(text):
+    """True when every line carrying an amount is a balance/total line."""
+    return all(SUMMARY_LINE.search(line) for line in text.splitlines() if MONEY.search(line))
+
+def read_statement(source, templates=None):
+    """Local pass over a statement PDF (path or binary file handle).
+
+    Returns (transactions, llm_pages): rows parsed from pages where every candidate row was understood, and the
+    text of the remaining pages that still contain amounts, for extract_transactions. Local rows are categorized
+    'Others'; categorization happens downstream."""
+    templates = TEMPLATES if templates is None else templates
+    transactions, llm_pages, cols = [], [], None
+    with pdfplumber.open(source) as pdf:
+        pages = [(page.extract_text() or "", page.extract_tables()) for page in pdf.pages]
+    document = "\n".join(text for text, _ in pages)
+    active = [t for t in templates if t.detect.search(document)]
+
+    summaries = []  # pages whose only amounts sit on summary lines (balances, totals)
+    for i, (text, tables) in enumerate(pages):
+        rows, unparsed, cols = parse_tables(tables, cols)
+        if not rows and not unparsed:
+            rows, unparsed = parse_lines(text, active)
+        if rows and not unparsed:
+            transactions.extend(dict(r, category='Others') for r in rows)
+        elif unparsed:
+            llm_pages.append((i, text))
+        elif MONEY.search(text):
+            # No row we recognise, yet amounts: a layout we can't see goes to the model unless it's plainly a summary
+            if _summaryPage(text): summaries.append((i, text))
+            else: llm_pages.append((i, text))
+    if not transactions:  # nothing recognised locally: the model gets the whole statement
+        llm_pages = sorted(llm_pages + summaries)
+    return transactions, [text for _, text in llm_pages]
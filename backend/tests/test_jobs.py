@@ -0,0 +1,45 @@
+import json
+import uuid
+from datetime import datetime
+from decimal import Decimal
+import pytest
+from backend import jobs
+from backend.jobs import background_job, _jsonable
+
+# Job payloads are stored as JSON/JSONB, so every argument must survive json.dumps once enqueue() has
+# normalized it. The session is replaced with a recorder; no database is involved.
+
+@background_job(name='test_payload_job')
+def payload_job(user_id, expense_ids, options=None):
+    pass
+
+class RecordingSession:
+    def __init__(self):
+        self.added = []
+
+    def add(self, obj):
+        self.added.append(obj)
+
+    def commit(self):
+        pass
+
+@pytest.fixture
+def session(monkeypatch):
+    recorder = RecordingSession()
+    monkeypatch.setattr(jobs.db, 'session', recorder)
+    return recorder
+
+def test_jsonable_recurses_into_containers():
+    ids = [uuid.uuid4(), uuid.uuid4()]
+    value = {"ids": tuple(ids), "when": datetime(2026, 10, 1), "amounts": [Decimal('1.50')]}
+    assert _jsonable(value) == {"ids": [str(i) for i in ids], "when": "2026-10-01T00:00:00", "amounts": ["1.50"]}
+
+def test_enqueue_list_of_uuids_is_json_serializable(session):
+    user_id, ids = uuid.uuid4(), [uuid.uuid4(), uuid.uuid4()]
+    payload_job(user_id, ids, options={"since": datetime(2026, 10, 1), "ids": ids})
+    job = session.added[0]
+    assert job.type == 'test_payload_job'
+    assert json.loads(json.dumps(job.payload)) == {
+        "args": [str(user_id), [str(i) for i in ids]],
+        "kwargs": {"options": {"since": "2026-10-01T00:00:00", "ids": [str(i) for i in ids]}},
+    }
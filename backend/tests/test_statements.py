@@ -0,0 +1,167 @@
+import pytest
+from backend import statements
+from backend.statements import chunk_pages, parse_tables, parse_lines, read_statement, TEMPLATES
+
+# Offline checks of the local statement extractors. Fixtures are generated in code; read_statement gets a
+# stand-in for pdfplumber.open that serves fixed page text and tables, so no PDF or model is involved.
+# Usage: python -m pytest backend/tests
+
+HEADER = ['Txn Date', 'Narration', 'Withdrawal Amt.', 'Deposit Amt.', 'Closing Balance']
+
+class FakePage:
+    def __init__(self, text='', tables=()):
+        self.text, self.tables = text, list(tables)
+
+    def extract_text(self):
+        return self.text
+
+    def extract_tables(self):
+        return self.tables
+
+class FakePdf:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+@pytest.fixture
+def pdf_pages(monkeypatch):
+    """Call with a list of FakePage; read_statement will open them instead of a file."""
+    def use(pages):
+        monkeypatch.setattr(statements.pdfplumber, 'open', lambda source: FakePdf(pages))
+    return use
+
+# --- chunk_pages ---
+
+def test_chunk_pages_keeps_small_pages_together():
+    assert chunk_pages(["a\nb", "c"], max_chars=100) == ["a\nb\nc"]
+
+def test_chunk_pages_repeats_overlap_rows():
+    chunks = chunk_pages(["\n".join(f"row {i}" for i in range(10))], max_chars=30, overlap_lines=1)
+    assert len(chunks) > 1
+    assert all(len(c) <= 30 for c in chunks)
+    assert chunks[1].splitlines()[0] == chunks[0].splitlines()[-1]
+
+def test_chunk_pages_hard_splits_oversized_line():
+    line = " ".join(f"01/10/2026 SHOP{i} 12.50 Dr" for i in range(200))  # a page extracted without line breaks
+    chunks = chunk_pages(["header", line], max_chars=500, overlap_lines=3)
+    assert all(len(c) <= 500 for c in chunks)
+    assert " ".join(" ".join(c.splitlines()) for c in chunks).count("SHOP199") >= 1
+
+def test_chunk_pages_splits_line_without_spaces():
+    chunks = chunk_pages(["x" * 1000], max_chars=100, overlap_lines=0)
+    assert all(len(c) <= 100 for c in chunks)
+    assert "".join(chunks) == "x" * 1000
+
+# --- parse_tables ---
+
+def test_parse_tables_debit_credit_columns():
+    table = [HEADER,
+             ['01/10/2026', 'UPI/SWIGGY', '250.00', '', '9,750.00'],
+             ['02/10/2026', 'SALARY OCT', '', '50,000.00', '59,750.00']]
+    rows, unparsed, cols = parse_tables([table])
+    assert unparsed == 0
+    assert rows == [
+        {"date": "2026-10-01", "description": "UPI/SWIGGY", "amount": 250.0, "type": "Paid"},
+        {"date": "2026-10-02", "description": "SALARY OCT", "amount": 50000.0, "type": "Received"},
+    ]
+    assert cols['date'] == 0 and cols['debit'] == 2
+
+def test_parse_tables_joins_wrapped_narration():
+    table = [HEADER,
+             ['01/10/2026', 'NEFT/ACME', '1,200.00', '', '8,800.00'],
+             ['', 'CORP LTD', '', '', '']]
+    rows, unparsed, _ = parse_tables([table])
+    assert unparsed == 0
+    assert rows[0]["description"] == "NEFT/ACME CORP LTD"
+
+def test_parse_tables_carries_header_across_pages():
+    _, _, cols = parse_tables([[HEADER, ['01/10/2026', 'A', '1.00', '', '9.00']]])
+    rows, unparsed, _ = parse_tables([[['03/10/2026', 'B', '', '2.00', '11.00']]], cols)
+    assert unparsed == 0
+    assert rows == [{"date": "2026-10-03", "description": "B", "amount": 2.0, "type": "Received"}]
+
+def test_parse_tables_counts_dated_rows_it_cannot_read():
+    table = [HEADER, ['01/10/2026', 'BOTH SIDES', '5.00', '5.00', '10.00']]
+    rows, unparsed, _ = parse_tables([table])
+    assert rows == [] and unparsed == 1
+
+def test_parse_tables_ignores_tables_without_header():
+    rows, unparsed, cols = parse_tables([[['foo', 'bar'], ['01/10/2026', '3.00']]])
+    assert (rows, unparsed, cols) == ([], 0, None)
+
+# --- parse_lines ---
+
+def test_parse_lines_drcr_suffix():
+    text = ("Statement of account\n"
+            "01/10/2026  UPI/SWIGGY/Order 1234   250.00 Dr   9,750.00 Cr\n"
+            "05 Oct 2026  REFUND AMAZON   1,499.00 Cr")
+    rows, unparsed = parse_lines(text, TEMPLATES)
+    assert unparsed == 0
+    assert rows == [
+        {"date": "2026-10-01", "description": "UPI/SWIGGY/Order 1234", "amount": 250.0, "type": "Paid"},
+        {"date": "2026-10-05", "description": "REFUND AMAZON", "amount": 1499.0, "type": "Received"},
+    ]
+
+def test_parse_lines_signed_amount():
+    text = "2026-10-01  SWIGGY BANGALORE   -250.00   9,750.00\n2026-10-02  INTEREST   +12.50"
+    rows, unparsed = parse_lines(text, TEMPLATES)
+    assert unparsed == 0
+    assert [(r["type"], r["amount"]) for r in rows] == [("Paid", 250.0), ("Received", 12.5)]
+
+def test_parse_lines_counts_candidate_rows_no_template_matches():
+    rows, unparsed = parse_lines("01/10/2026  SWIGGY  250.00  9,750.00", TEMPLATES)
+    assert rows == [] and unparsed == 1
+
+def test_parse_lines_skips_non_candidate_lines():
+    assert parse_lines("Opening Balance 10,000.00\nPage 1 of 2", TEMPLATES) == ([], 0)
+
+# --- read_statement ---
+
+def test_read_statement_parses_known_layout_locally(pdf_pages):
+    pdf_pages([FakePage("01/10/2026  UPI/SWIGGY   250.00 Dr   9,750.00 Cr")])
+    transactions, llm_pages = read_statement('statement.pdf')
+    assert llm_pages == []
+    assert transactions == [{"date": "2026-10-01", "description": "UPI/SWIGGY", "amount": 250.0,
+                             "type": "Paid", "category": "Others"}]
+
+def test_read_statement_sends_unparsed_page_to_model(pdf_pages):
+    unknown = "01/10/2026  SWIGGY  250.00  9,750.00"
+    pdf_pages([FakePage("02/10/2026  UBER   120.00 Dr"), FakePage(unknown)])
+    transactions, llm_pages = read_statement('statement.pdf')
+    assert len(transactions) == 1
+    assert llm_pages == [unknown]
+
+def test_read_statement_sends_quiet_page_with_unknown_layout_to_model(pdf_pages):
+    # Amounts but no row starting with a date: a layout the local pass can't see, not a summary
+    quiet = "SWIGGY on Oct 1 2026  250.00\nUBER on Oct 2 2026  120.00"
+    pdf_pages([FakePage("02/10/2026  UBER   120.00 Dr"), FakePage(quiet)])
+    transactions, llm_pages = read_statement('statement.pdf')
+    assert len(transactions) == 1
+    assert llm_pages == [quiet]
+
+def test_read_statement_drops_summary_page_once_layout_is_known(pdf_pages):
+    summary = "Account Summary\nOpening Balance 10,000.00\nTotal Debits 370.00\nClosing Balance 9,630.00"
+    pdf_pages([FakePage("02/10/2026  UBER   120.00 Dr"), FakePage(summary)])
+    transactions, llm_pages = read_statement('statement.pdf')
+    assert len(transactions) == 1
+    assert llm_pages == []
+
+def test_read_statement_sends_everything_when_nothing_parsed(pdf_pages):
+    summary = "Opening Balance 10,000.00"
+    unknown = "01/10/2026  SWIGGY  250.00  9,750.00"
+    pdf_pages([FakePage(summary), FakePage(unknown), FakePage("Terms and conditions")])
+    transactions, llm_pages = read_statement('statement.pdf')
+    assert transactions == []
+    assert llm_pages == [summary, unknown]
+
+def test_read_statement_uses_tables_across_pages(pdf_pages):
+    pdf_pages([FakePage("ignored", [[HEADER, ['01/10/2026', 'A', '1.00', '', '9.00']]]),
+               FakePage("ignored", [[['03/10/2026', 'B', '', '2.00', '11.00']]])])
+    transactions, llm_pages = read_statement('statement.pdf')
+    assert [t["description"] for t in transactions] == ["A", "B"]
+    assert llm_pages == []
@@ -1,52 +1,221 @@
 from .extensions import db
-from .models import User, Expense, MonthlySummary
-from sqlalchemy import func
+from .models import User, Expense, MonthlySummary, UserLedgerTotals, DirtyMonth, DailyExpenseRollup, SpendingStats, AnomalyWarning, ReceiptAnalysis
+from sqlalchemy import func, case, cast
 from datetime import datetime, timedelta
 import calendar
+import re
+import sys
+import uuid
 import os
 import json
+import base64
+import hashlib
 import threading
+import time
 from decimal import Decimal
 import google.generativeai as genai
 from flask import current_app
+from .jobs import background_job
+from .llm_cache import cachedGenerate
+from .ai_client import ModelClient, BACKGROUND, INTERACTIVE, AIUnavailable
 
 CATS = ['Food & Drinks', 'Travel', 'Bills & Utilities', 'Shopping', 'Health', 'Education', 'Groceries', 'Others']
 
-def calculateMonthlySummary(user_id, year, month):
-    user = User.query.get(user_id)
-    if not user: return None
+# --- MERCHANT NORMALIZATION ---
+# Titles are reduced to a few normalized tokens ("UPI/SWIGGY/Order 1234" -> SWIGGY). Shared by the merchant
+# index and the duplicate-charge fingerprint so both treat "UBER *TRIP 123" and "UBER TRIP" as one merchant.
+
+NOISE_TOKENS = frozenset({
+    'UPI', 'POS', 'NEFT', 'IMPS', 'RTGS', 'ACH', 'ECS', 'NACH', 'ATM', 'TXN', 'TRF', 'TRANSFER', 'REF', 'PAYMENT',
+    'PAY', 'PURCHASE', 'ORDER', 'DEBIT', 'CREDIT', 'CARD', 'INR', 'RS', 'THE', 'AND', 'OF', 'TO', 'FROM', 'BY', 'FOR',
+    'PVT', 'LTD', 'PRIVATE', 'LIMITED', 'INDIA', 'IN', 'COM', 'WWW', 'ONLINE', 'VIA',
+})
+MAX_TOKENS = 3
+
+def merchantTokens(title):
+    """Up to MAX_TOKENS significant upper-cased tokens; digits-only and noise tokens are dropped."""
+    tokens = []
+    for tok in re.split(r'[^A-Za-z0-9]+', (title or '').upper()):
+        if len(tok) < 2 or tok.isdigit() or tok in NOISE_TOKENS: continue
+        tokens.append(sys.intern(tok))
+        if len(tokens) == MAX_TOKENS: break
+    return tuple(tokens)
+
+def merchantFingerprint(title):
+    """Value of Expense.merchant_fingerprint; falls back to the bare alphanumerics when every token is noise."""
+    return (' '.join(merchantTokens(title)) or re.sub(r'[^A-Z0-9]+', '', (title or '').upper()))[:64]
+
+# --- PERIOD HELPERS ---
+# Range predicates on the raw column keep idx_expenses_user_date usable;
+# extract()/date() wrapped around expense_date force a scan of the user's whole history.
+
+def monthBounds(year, month):
+    """Half-open [start, end) timestamps covering a calendar month."""
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
+
+def dayBounds(day):
+    """Half-open [start, end) timestamps covering a single day."""
+    start = datetime(day.year, day.month, day.day)
+    return start, start + timedelta(days=1)
+
+def inPeriod(bounds, column=None):
+    """Sargable filter for a (start, end) pair from monthBounds/dayBounds."""
+    column = Expense.expense_date if column is None else column
+    start, end = bounds
+    return db.and_(column >= start, column < end)
+
+# --- KEYSET PAGINATION ---
+
+PAGE_SIZE = 50
+
+def encodeCursor(ts, row_id):
+    """ts=None marks a position in the NULL-date tail."""
+    return base64.urlsafe_b64encode(f"{ts.isoformat() if ts else ''}|{row_id}".encode()).decode()
+
+def decodeCursor(cursor):
+    """Inverse of encodeCursor. Raises ValueError on a malformed cursor."""
+    try:
+        ts, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return (datetime.fromisoformat(ts) if ts else None), uuid.UUID(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def keysetPage(query, date_col, id_col, cursor=None, limit=PAGE_SIZE):
+    """One page of `query` ordered by (date_col DESC, id_col DESC) with NULL dates last, resuming after `cursor`.
+    The `date_col <= ts` bound keeps the seek on the (user_id, date DESC) index instead of an OFFSET scan; rows
+    with a NULL date are served afterwards by an id-only seek, so they are reached the same way on every backend.
+    Returns (rows, next_cursor); next_cursor is None on the last page."""
+    ts, row_id = decodeCursor(cursor) if cursor else (None, None)
+    rows = []
+    if not cursor or ts is not None:
+        dated = query.filter(date_col.isnot(None))
+        if cursor:
+            dated = dated.filter(date_col <= ts, db.or_(date_col < ts, id_col < row_id))
+        rows = dated.order_by(date_col.desc(), id_col.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        undated = query.filter(date_col.is_(None))
+        if cursor and ts is None:
+            undated = undated.filter(id_col < row_id)
+        rows += undated.order_by(id_col.desc()).limit(limit + 1 - len(rows)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encodeCursor(getattr(rows[-1], date_col.key), getattr(rows[-1], id_col.key))
+    return rows, next_cursor
+
+# --- LEDGER STATS ---
+
+def _paidReceived():
+    return {"Paid": Decimal(0), "Received": Decimal(0)}
+
+def ledgerStats(user_id, *criteria, month=None, days=0, today=None):
+    """Paid/Received totals for one user from a single conditional-aggregation statement.
+
+    Rows are grouped by (category, type, day) where day is only set inside the trailing `days` window,
+    so the result stays small no matter how long the history is. Returns:
+        all_time     {type: amount}            every row matching `criteria`
+        month        {type: amount}            rows inside month=(year, month), if given
+        by_category  {category: {type: amount}}
+        by_day       {date: {type: amount}}    one entry per day of the window, oldest first
+    """
+    group = [Expense.category, Expense.type]
+    columns = group + [func.sum(Expense.amount)]
+    if month:
+        columns.append(func.sum(case((inPeriod(monthBounds(*month)), Expense.amount), else_=0)))
+
+    window = []
+    if days:
+        today = today or datetime.utcnow().date()
+        window = [today - timedelta(days=i) for i in range(days - 1, -1, -1)]
+        start, _ = dayBounds(window[0])
+        _, end = dayBounds(today)
+        day_key = case((inPeriod((start, end)), func.date(Expense.expense_date)), else_=None).label('day')
+        columns.append(day_key)
+        group.append(day_key)
+
+    q = db.session.query(*columns).filter(Expense.user_id == user_id, *criteria).group_by(*group)
+
+    stats = {
+        "all_time": _paidReceived(),
+        "month": _paidReceived(),
+        "by_category": {},
+        "by_day": {d: _paidReceived() for d in window}
+    }
+    for row in q.all():
+        category, tran_type, total = row[0], row[1] or 'Paid', row[2] or Decimal(0)
+        if tran_type not in ('Paid', 'Received'): continue
+        stats["all_time"][tran_type] += total
+        stats["by_category"].setdefault(category, _paidReceived())[tran_type] += total
+        if month:
+            stats["month"][tran_type] += row[3] or Decimal(0)
+        if days and row[-1] is not None:
+            day = row[-1] if not isinstance(row[-1], str) else datetime.strptime(row[-1], '%Y-%m-%d').date()
+            stats["by_day"][day][tran_type] += total
+    return stats
+
+def _goalStatus(savings_goal, year, month, monthly_savings):
+    now = datetime.utcnow()
+    last_day = calendar.monthrange(year, month)[1]
+    month_end_date = datetime(year, month, last_day, 23, 59, 59)
+
+    if now > month_end_date:
+        return "ACHIEVED" if monthly_savings >= (savings_goal or Decimal(0)) else "NOT_ACHIEVED"
+    return "PENDING"
+
+def _scanLedgerTotals(user_id):
+    """All-time included (income, expenses) for a user, straight from the expenses table."""
+    totals = ledgerStats(user_id, Expense.include_in_total == True)["all_time"]
+    return totals["Received"], totals["Paid"]
+
+def _seedLedgerTotals(user_id):
+    """Inserts the totals row from one ledger scan. Returns False if a concurrent writer seeded it first
+    (its scan can't see our uncommitted rows, so the caller must then apply its own delta)."""
+    income, expenses = _scanLedgerTotals(user_id)
+    stmt = _dialectInsert(UserLedgerTotals).values(user_id=user_id, total_income=income, total_expenses=expenses)
+    return db.session.execute(stmt.on_conflict_do_nothing(index_elements=['user_id'])).rowcount == 1
+
+def getLedgerTotals(user_id, create=True):
+    """Per-user running totals (primary-key lookup). A missing row is backfilled from one ledger scan."""
+    user_id = uuid.UUID(str(user_id))
+    totals = UserLedgerTotals.query.get(user_id)
+    if totals or not create: return totals
+
+    _seedLedgerTotals(user_id)
+    return UserLedgerTotals.query.get(user_id)
+
+def getCurrentBalance(user):
+    """Dashboard ledger truth: profile income + all-time credits - all-time debits."""
+    base = user.monthly_income if user.monthly_income else Decimal(0)
+    totals = getLedgerTotals(user.id, create=False)
+    if totals:
+        return base + totals.total_income - totals.total_expenses
+    income, expenses = _scanLedgerTotals(user.id)
+    return base + income - expenses
+
+def _computeMonthlyLedger(user, year, month, rescan=False):
+    """Recompute of one month from raw transactions. The all-time balance comes from
+    user_ledger_totals unless rescan is set (verify mode)."""
+    user_id = user.id
 
     # LEDGER RULE: Recalculate everything from raw transactions
-    # totalSpent = sum(debits for month)
-    total_paid = db.session.query(func.sum(Expense.amount)).filter(
-        Expense.user_id == user_id,
-        Expense.type == 'Paid',
-        Expense.include_in_total == True,
-        func.extract('year', Expense.expense_date) == year,
-        func.extract('month', Expense.expense_date) == month
-    ).scalar() or Decimal(0)
-
-    # totalIncome = sum(credits for month)
-    total_received = db.session.query(func.sum(Expense.amount)).filter(
-        Expense.user_id == user_id,
-        Expense.type == 'Received',
-        Expense.include_in_total == True,
-        func.extract('year', Expense.expense_date) == year,
-        func.extract('month', Expense.expense_date) == month
-    ).scalar() or Decimal(0)
+    # Verify mode reads month and all-time sums in one pass; otherwise only the month range is scanned
+    criteria = [Expense.include_in_total == True]
+    if not rescan: criteria.append(inPeriod(monthBounds(year, month)))
+    stats = ledgerStats(user_id, *criteria, month=(year, month))
+
+    # totalSpent = sum(debits for month), totalIncome = sum(credits for month)
+    total_paid = stats["month"]["Paid"]
+    total_received = stats["month"]["Received"]
 
     # GLOBAL LEDGER TRUTH: total income - total expenses across ALL time
-    global_income = db.session.query(func.sum(Expense.amount)).filter(
-        Expense.user_id == user_id,
-        Expense.type == 'Received',
-        Expense.include_in_total == True
-    ).scalar() or Decimal(0)
-    
-    global_expense = db.session.query(func.sum(Expense.amount)).filter(
-        Expense.user_id == user_id,
-        Expense.type == 'Paid',
-        Expense.include_in_total == True
-    ).scalar() or Decimal(0)
+    if rescan:
+        global_income, global_expense = stats["all_time"]["Received"], stats["all_time"]["Paid"]
+    else:
+        totals = getLedgerTotals(user_id)
+        global_income, global_expense = totals.total_income, totals.total_expenses
 
     # Current Balance = Previous Balance + totalIncome - totalSpent
     # Here, we derive it from absolute ledger for maximum consistency
@@ -55,28 +224,32 @@ def calculateMonthlySummary(user_id, year, month):
     monthly_income = user.monthly_income + total_received
     monthly_savings = monthly_income - total_paid
 
-    # Atomic Update 
-    summary = MonthlySummary.query.filter_by(user_id=user_id, year=year, month=month).first()
-    if not summary:
-        summary = MonthlySummary(user_id=user_id, year=year, month=month)
-        db.session.add(summary)
-
-    summary.total_income = monthly_income
-    summary.total_expenses = total_paid
-    summary.total_savings = monthly_savings
-    summary.current_balance = current_balance
-    
-    now = datetime.utcnow()
-    last_day = calendar.monthrange(year, month)[1]
-    month_end_date = datetime(year, month, last_day, 23, 59, 59)
+    return {
+        "total_income": monthly_income,
+        "total_expenses": total_paid,
+        "total_savings": monthly_savings,
+        "current_balance": current_balance,
+        "goal_status": _goalStatus(user.savings_goal, year, month, monthly_savings)
+    }
 
-    if now > month_end_date:
-        summary.goal_status = "ACHIEVED" if monthly_savings >= user.savings_goal else "NOT_ACHIEVED"
-    else:
-        summary.goal_status = "PENDING"
+def calculateMonthlySummary(user_id, year, month, commit=True):
+    """Recomputes one month from the ledger and upserts its summary. The summary row is locked before the
+    scan (FOR UPDATE; SQLite has a single writer anyway), so increments from concurrent writers queue behind
+    this recompute instead of being overwritten by it."""
+    user = User.query.get(user_id)
+    if not user: return None
+    month_rows = MonthlySummary.query.filter_by(user_id=user.id, year=year, month=month)
+    month_rows.with_for_update().first()
 
-    db.session.commit()
-    return summary
+    ledger = _computeMonthlyLedger(user, year, month)
+
+    # Atomic Update: two recomputes of a month that has no row yet both land on the unique key
+    stmt = _dialectInsert(MonthlySummary).values(user_id=user.id, year=year, month=month, **ledger)
+    db.session.execute(stmt.on_conflict_do_update(index_elements=['user_id', 'year', 'month'],
+                                                  set_=dict(ledger, last_updated=func.now(), updated_at=func.now())))
+
+    if commit: db.session.commit()
+    return month_rows.populate_existing().first()
 
 def runMonthlyEvaluation(user_id):
     now = datetime.utcnow()
@@ -85,6 +258,637 @@ def runMonthlyEvaluation(user_id):
     prev = now.replace(day=1) - timedelta(days=1)
     calculateMonthlySummary(user_id, prev.year, prev.month)
 
+# --- INCREMENTAL LEDGER MAINTENANCE ---
+
+def _dialectInsert(model):
+    """INSERT construct with ON CONFLICT support for the bound database (Postgres or SQLite)."""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+def markMonthDirty(user_id, year, month):
+    """Queues (user, year, month) for a full recompute. Runs inside the caller's transaction;
+    re-marking bumps marked_at so a drain that is already in flight won't drop it."""
+    stmt = _dialectInsert(DirtyMonth).values(user_id=uuid.UUID(str(user_id)), year=year, month=month, marked_at=datetime.utcnow())
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id', 'year', 'month'],
+        set_={'marked_at': stmt.excluded.marked_at}))
+
+def markRecentMonthsDirty(user_id):
+    """Current and previous month, the window runMonthlyEvaluation used to refresh."""
+    now = datetime.utcnow()
+    prev = now.replace(day=1) - timedelta(days=1)
+    markMonthDirty(user_id, now.year, now.month)
+    markMonthDirty(user_id, prev.year, prev.month)
+
+
+def _ledgerDeltas(expenses, sign):
+    """Groups signed (paid, received) amounts by (user_id, year, month)."""
+    deltas = {}
+    for exp in expenses:
+        d = exp.expense_date or datetime.utcnow()
+        key = (uuid.UUID(str(exp.user_id)), d.year, d.month)
+        paid, received = deltas.get(key, (Decimal(0), Decimal(0)))
+        amt = Decimal(str(exp.amount or 0)) * sign
+        if (exp.type or 'Paid') == 'Received': received += amt
+        else: paid += amt
+        deltas[key] = (paid, received)
+    return deltas
+
+def _applyLedgerDeltas(deltas):
+    by_user = {}
+    for (user_id, _, _), (paid, received) in deltas.items():
+        u_paid, u_received = by_user.get(user_id, (Decimal(0), Decimal(0)))
+        by_user[user_id] = (u_paid + paid, u_received + received)
+
+    for user_id, (paid, received) in by_user.items():
+        # Running totals move with SQL-side increments so concurrent writers don't lose updates.
+        # A backfill scan already includes the flushed write, unless another writer seeded the row first.
+        seeded = not getLedgerTotals(user_id, create=False) and _seedLedgerTotals(user_id)
+        if not seeded and (paid or received):
+            UserLedgerTotals.query.filter_by(user_id=user_id).update({
+                UserLedgerTotals.total_income: UserLedgerTotals.total_income + received,
+                UserLedgerTotals.total_expenses: UserLedgerTotals.total_expenses + paid
+            })
+
+        # current_balance is an all-time figure, so every materialized month of the user shifts by the net change
+        net = received - paid
+        if net:
+            MonthlySummary.query.filter_by(user_id=user_id).update(
+                {MonthlySummary.current_balance: MonthlySummary.current_balance + net})
+
+    users = {}
+    for (user_id, year, month), (paid, received) in deltas.items():
+        user = users.get(user_id) or User.query.get(user_id)
+        if not user: continue
+        users[user_id] = user
+
+        # SQL-side increments, like the running totals above: concurrent writers to one month can't lose a delta
+        month_rows = MonthlySummary.query.filter_by(user_id=user_id, year=year, month=month)
+        updated = month_rows.update({
+            MonthlySummary.total_expenses: func.coalesce(MonthlySummary.total_expenses, 0) + paid,
+            MonthlySummary.total_income: func.coalesce(MonthlySummary.total_income, 0) + received,
+            MonthlySummary.total_savings: func.coalesce(MonthlySummary.total_savings, 0) + received - paid
+        }, synchronize_session=False)
+        if not updated:
+            # No materialized row yet: the background worker seeds it from the ledger.
+            # The month before is queued too so its goal_status gets closed on rollover.
+            prev = datetime(year, month, 1) - timedelta(days=1)
+            markMonthDirty(user_id, year, month)
+            markMonthDirty(user_id, prev.year, prev.month)
+            continue
+
+        # The UPDATE holds the row lock, so the savings read back here include every committed delta
+        savings = db.session.query(MonthlySummary.total_savings).filter_by(user_id=user_id, year=year, month=month).scalar()
+        month_rows.update({MonthlySummary.goal_status: _goalStatus(user.savings_goal, year, month, savings)},
+                          synchronize_session=False)
+
+def applyExpenseDelta(expenses, sign=1):
+    """Adjusts the affected MonthlySummary rows and daily rollups for inserted (sign=1) or deleted
+    (sign=-1) expenses without rescanning the ledger. Call after the Expense write is flushed; the
+    caller commits, so the summary moves in the same transaction as the write."""
+    if isinstance(expenses, Expense): expenses = [expenses]
+    # Anomaly baselines cover every Paid row, counted in totals or not
+    _applySpendingStatsDeltas(expenses, sign)
+    included = [e for e in expenses if e.include_in_total is not False]
+    if included:
+        _applyLedgerDeltas(_ledgerDeltas(included, sign))
+        _applyRollupDeltas(included, sign)
+
+def setExpenseIncluded(exp, include):
+    """Toggles include_in_total and moves the expense in or out of the ledger totals."""
+    if bool(exp.include_in_total) == bool(include): return
+    exp.include_in_total = bool(include)
+    db.session.flush()
+    _applyLedgerDeltas(_ledgerDeltas([exp], 1 if include else -1))
+    _applyRollupDeltas([exp], 1 if include else -1)
+
+# --- STATEMENT INGESTION ---
+
+INGEST_CHUNK = 500
+
+def transactionHash(user_id, raw_date, desc, amount, tran_type):
+    """DUPLICATE PROTECTION: Unique Hash for Ledger Consistency"""
+    hash_str = f"{user_id}-{raw_date}-{desc}-{abs(amount)}-{tran_type}"
+    return hashlib.sha256(hash_str.encode()).hexdigest()
+
+def ingestParsedTransactions(user_id, transactions, statement_tag):
+    """Bulk-inserts extracted statement rows ([{date, description, amount, category, type}]).
+
+    All rows are hashed up front, existing hashes are resolved with chunked IN queries, and new rows go in
+    with INSERT ... ON CONFLICT (transaction_hash) DO NOTHING RETURNING id, so a concurrent upload of the same
+    statement can't double count. Ledger deltas are applied for the rows that actually landed; the caller commits.
+    Returns (inserted_expenses, skipped_count)."""
+    user_id = uuid.UUID(str(user_id))
+    rows, skipped = {}, 0
+    for t in transactions:
+        # Validate
+        if not t.get('amount'):
+            skipped += 1; continue
+
+        amt = float(t['amount'])
+        raw_date = t.get('date', datetime.utcnow().strftime('%Y-%m-%d'))
+        desc = t.get('description', 'Unknown')
+        tran_type = t.get('type', 'Paid')
+        try:
+            expense_date = datetime.strptime(raw_date, '%Y-%m-%d') if raw_date else datetime.utcnow()
+        except ValueError:
+            skipped += 1; continue
+
+        t_hash = transactionHash(user_id, raw_date, desc, amt, tran_type)
+        if t_hash in rows:
+            skipped += 1; continue
+        rows[t_hash] = {
+            "id": uuid.uuid4(), "user_id": user_id, "title": desc[:100], "amount": Decimal(str(abs(amt))),
+            "merchant_fingerprint": merchantFingerprint(desc[:100]),
+            "category": t.get('category', 'Others'), "type": tran_type, "expense_date": expense_date,
+            "is_parsed": True, "statement_tag": statement_tag, "transaction_hash": t_hash,
+            "include_in_total": True, "is_anomaly": False
+        }
+
+    hashes = list(rows)
+    for i in range(0, len(hashes), INGEST_CHUNK):
+        existing = db.session.query(Expense.transaction_hash).filter(Expense.transaction_hash.in_(hashes[i:i + INGEST_CHUNK]))
+        for (t_hash,) in existing:
+            rows.pop(t_hash, None); skipped += 1
+
+    values = list(rows.values())
+    inserted_ids = set()
+    for i in range(0, len(values), INGEST_CHUNK):
+        stmt = _dialectInsert(Expense).values(values[i:i + INGEST_CHUNK]) \
+            .on_conflict_do_nothing(index_elements=['transaction_hash']).returning(Expense.id)
+        inserted_ids.update(r[0] for r in db.session.execute(stmt))
+    skipped += len(values) - len(inserted_ids)
+
+    # Transient objects carry the inserted values through the delta path without another SELECT
+    inserted = [Expense(**v) for v in values if v["id"] in inserted_ids]
+    applyExpenseDelta(inserted)
+    return inserted, skipped
+
+def drainDirtyMonths(limit=100):
+    """Recomputes up to `limit` dirty months from the ledger. Returns how many were drained.
+
+    Each month is claimed with a compare-and-set UPDATE on its mark and recomputed, upserted and un-marked in
+    that same transaction. The claim holds the mark's row lock (Postgres) or the write lock (SQLite) until the
+    commit, so a concurrent re-mark lands after it and queues another pass instead of being dropped, and a
+    second drainer skips (SKIP LOCKED) or loses the CAS rather than recomputing the month twice."""
+    q = db.session.query(DirtyMonth.user_id, DirtyMonth.year, DirtyMonth.month, DirtyMonth.marked_at) \
+        .order_by(DirtyMonth.marked_at).limit(limit)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        q = q.with_for_update(skip_locked=True)
+    marks = q.all()
+
+    drained = 0
+    for user_id, year, month, marked_at in marks:
+        mark = DirtyMonth.query.filter_by(user_id=user_id, year=year, month=month, marked_at=marked_at)
+        if not mark.update({DirtyMonth.marked_at: marked_at}, synchronize_session=False):
+            db.session.rollback(); continue  # drained or re-marked by someone else
+        calculateMonthlySummary(user_id, year, month, commit=False)
+        mark.delete(synchronize_session=False)
+        db.session.commit()
+        drained += 1
+    return drained
+
+def closeEndedMonths(limit=500):
+    """Settles goal_status for PENDING summaries whose month is over."""
+    now = datetime.utcnow()
+    stale = MonthlySummary.query.filter(
+        MonthlySummary.goal_status == "PENDING",
+        db.or_(MonthlySummary.year < now.year, db.and_(MonthlySummary.year == now.year, MonthlySummary.month < now.month))
+    ).limit(limit).all()
+    for summary in stale:
+        summary.goal_status = _goalStatus(summary.user.savings_goal, summary.year, summary.month, summary.total_savings or Decimal(0))
+    db.session.commit()
+    return len(stale)
+
+def startSummaryWorker(app, interval=None):
+    """Background recompute loop so request handlers only ever read materialized summaries."""
+    interval = interval or app.config.get('SUMMARY_WORKER_INTERVAL', 5)
+
+    def loop():
+        while True:
+            with app.app_context():
+                try:
+                    while drainDirtyMonths(): pass
+                    closeEndedMonths()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"SUMMARY WORKER ERROR: {e}")
+                finally:
+                    db.session.remove()
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, name='summary-worker', daemon=True)
+    thread.start()
+    return thread
+
+def verifyMonthlySummaries(user_id=None, repair=False):
+    """Verify/repair mode: recomputes every materialized month from raw transactions and
+    reports rows whose delta-maintained totals drifted. Meant for scripts, not the request path."""
+    q = MonthlySummary.query
+    if user_id: q = q.filter_by(user_id=user_id)
+
+    drifted = []
+    users = {}
+    for summary in q.order_by(MonthlySummary.user_id, MonthlySummary.year, MonthlySummary.month).all():
+        user = users.get(summary.user_id) or User.query.get(summary.user_id)
+        users[summary.user_id] = user
+        ledger = _computeMonthlyLedger(user, summary.year, summary.month, rescan=True)
+
+        diff = {f: (getattr(summary, f), v) for f, v in ledger.items() if getattr(summary, f) != v}
+        if not diff: continue
+        drifted.append((summary.user_id, summary.year, summary.month, diff))
+        if repair:
+            for field, (_, value) in diff.items():
+                setattr(summary, field, value)
+
+    if repair: db.session.commit()
+    return drifted
+
+def reconcileLedgerTotals(user_id=None, repair=False):
+    """Compares user_ledger_totals with one GROUP BY pass over expenses.
+    Returns [(user_id, stored, actual)] for drifted or missing rows; repair rewrites them."""
+    q = db.session.query(
+        User.id,
+        func.sum(case(((Expense.type == 'Received') & (Expense.include_in_total == True), Expense.amount), else_=0)),
+        func.sum(case(((Expense.type == 'Paid') & (Expense.include_in_total == True), Expense.amount), else_=0))
+    ).outerjoin(Expense, Expense.user_id == User.id).group_by(User.id)
+    totals_q = UserLedgerTotals.query
+    if user_id:
+        user_id = uuid.UUID(str(user_id))
+        q = q.filter(User.id == user_id)
+        totals_q = totals_q.filter_by(user_id=user_id)
+    stored = {t.user_id: t for t in totals_q.all()}
+
+    drifted = []
+    for uid, income, expenses in q.all():
+        actual = (income or Decimal(0), expenses or Decimal(0))
+        totals = stored.get(uid)
+        current = (totals.total_income, totals.total_expenses) if totals else None
+        if current == actual: continue
+        drifted.append((uid, current, actual))
+        if repair:
+            if not totals:
+                totals = UserLedgerTotals(user_id=uid)
+                db.session.add(totals)
+            totals.total_income, totals.total_expenses = actual
+
+    if repair: db.session.commit()
+    return drifted
+
+# --- DAILY ROLLUPS ---
+
+BUCKETS = ('day', 'week', 'month')
+
+def _applyRollupDeltas(expenses, sign):
+    deltas = {}
+    for exp in expenses:
+        key = (uuid.UUID(str(exp.user_id)), (exp.expense_date or datetime.utcnow()).date(), exp.category, exp.type or 'Paid')
+        amount, count = deltas.get(key, (Decimal(0), 0))
+        deltas[key] = (amount + Decimal(str(exp.amount or 0)) * sign, count + sign)
+
+    rows = [{"user_id": u, "day": d, "category": c, "type": t, "total_amount": a, "txn_count": n}
+            for (u, d, c, t), (a, n) in deltas.items()]
+    stmt = _dialectInsert(DailyExpenseRollup).values(rows)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id', 'day', 'category', 'type'],
+        set_={'total_amount': DailyExpenseRollup.total_amount + stmt.excluded.total_amount,
+              'txn_count': DailyExpenseRollup.txn_count + stmt.excluded.txn_count}))
+
+def _bucketStart(day, bucket):
+    if bucket == 'week': return day - timedelta(days=day.weekday())
+    if bucket == 'month': return day.replace(day=1)
+    return day
+
+def _nextBucket(start, bucket):
+    if bucket == 'week': return start + timedelta(days=7)
+    if bucket == 'month': return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+def rollupSeries(user_id, start, end, bucket='day', category=None):
+    """Time series from daily_expense_rollups for start <= day <= end, bucketed by day, ISO week or month.
+    Empty buckets are zero-filled so every series lines up with `labels`."""
+    q = DailyExpenseRollup.query.filter(
+        DailyExpenseRollup.user_id == uuid.UUID(str(user_id)),
+        DailyExpenseRollup.day >= start,
+        DailyExpenseRollup.day <= end
+    )
+    if category: q = q.filter(DailyExpenseRollup.category == category)
+
+    labels = []
+    b = _bucketStart(start, bucket)
+    while b <= end:
+        labels.append(b)
+        b = _nextBucket(b, bucket)
+    pos = {b: i for i, b in enumerate(labels)}
+
+    totals = {"Paid": [0.0] * len(labels), "Received": [0.0] * len(labels)}
+    categories = {}
+    for r in q.all():
+        if r.type not in totals: continue
+        i = pos[_bucketStart(r.day, bucket)]
+        totals[r.type][i] += float(r.total_amount)
+        series = categories.setdefault(r.category, {"Paid": [0.0] * len(labels), "Received": [0.0] * len(labels)})
+        series[r.type][i] += float(r.total_amount)
+
+    return {
+        "bucket": bucket,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "labels": [b.isoformat() for b in labels],
+        "totals": totals,
+        "categories": categories
+    }
+
+def rebuildDailyRollups(lo=None, hi=None):
+    """Recreates daily_expense_rollups for users with lo <= id < hi with one INSERT ... SELECT."""
+    day_col = func.date(Expense.expense_date)
+    DailyExpenseRollup.query.filter(*_userRangeFilter(DailyExpenseRollup.user_id, lo, hi)).delete(synchronize_session=False)
+    src = db.select(
+        Expense.user_id, day_col, Expense.category, func.coalesce(Expense.type, 'Paid'),
+        func.sum(Expense.amount), func.count(Expense.id)
+    ).where(
+        Expense.include_in_total == True,
+        Expense.expense_date != None,
+        *_userRangeFilter(Expense.user_id, lo, hi)
+    ).group_by(Expense.user_id, day_col, Expense.category, func.coalesce(Expense.type, 'Paid'))
+    result = db.session.execute(db.insert(DailyExpenseRollup).from_select(
+        ['user_id', 'day', 'category', 'type', 'total_amount', 'txn_count'], src))
+    db.session.commit()
+    return result.rowcount
+
+# --- SPENDING STATISTICS ---
+# Per-user / per-category count, mean and M2 of Paid amounts, merged batch-wise with the parallel Welford
+# (Chan et al.) update so LARGE_EXPENSE checks read one row instead of averaging the whole history.
+
+ALL_CATEGORIES = '*'
+ANOMALY_MIN_SAMPLES = 10   # below this a category falls back to the user's overall stats
+ANOMALY_Z = 3.0
+LARGE_EXPENSE_FLOOR = 1000
+DUPLICATE_WINDOW = timedelta(hours=24)
+DUPLICATE_REASON = "Possible duplicate charge detected within 24 hours."
+
+def _welford(amounts):
+    """(n, mean, M2) of a batch."""
+    n, mean, m2 = 0, 0.0, 0.0
+    for x in amounts:
+        n += 1
+        delta = x - mean
+        mean += delta / n
+        m2 += delta * (x - mean)
+    return n, mean, m2
+
+def _mergeSpendingStats(user_id, category, n_b, mean_b, m2_b, sign):
+    S = SpendingStats
+    if sign > 0:
+        total = S.n + n_b
+        stmt = _dialectInsert(S).values(user_id=user_id, category=category, n=n_b, mean=mean_b, m2=m2_b)
+        stmt = stmt.on_conflict_do_update(index_elements=['user_id', 'category'], set_={
+            "n": total,
+            "mean": (S.mean * S.n + mean_b * n_b) / total,
+            "m2": S.m2 + m2_b + (S.mean - mean_b) * (S.mean - mean_b) * S.n * n_b / total,
+            "updated_at": func.now(),
+        })
+        db.session.execute(stmt)
+        return
+    # Removing a batch inverts the merge; the running stats always contain the rows being removed
+    rest = S.n - n_b
+    rest_mean = (S.mean * S.n - mean_b * n_b) / case((rest > 0, rest), else_=1)
+    m2 = S.m2 - m2_b - (rest_mean - mean_b) * (rest_mean - mean_b) * rest * n_b / S.n
+    db.session.execute(S.__table__.update()
+                       .where(S.user_id == user_id, S.category == category)
+                       .values(n=case((rest > 0, rest), else_=0),
+                               mean=case((rest > 0, rest_mean), else_=0.0),
+                               m2=case((rest > 1, case((m2 > 0, m2), else_=0.0)), else_=0.0),
+                               updated_at=func.now()))
+
+def _applySpendingStatsDeltas(expenses, sign):
+    batches = {}
+    for exp in expenses:
+        if (exp.type or 'Paid') != 'Paid': continue
+        user_id = uuid.UUID(str(exp.user_id))
+        for category in (ALL_CATEGORIES, exp.category):
+            batches.setdefault((user_id, category), []).append(float(exp.amount or 0))
+
+    backfilled, checked = set(), set()
+    for (user_id, category), amounts in batches.items():
+        if user_id not in checked:
+            checked.add(user_id)
+            # The backfill scan already includes the flushed write, unless another writer seeded the rows first
+            if not SpendingStats.query.get((user_id, ALL_CATEGORIES)) and rebuildSpendingStats(user_id, replace=False):
+                backfilled.add(user_id)
+        if user_id in backfilled: continue
+        _mergeSpendingStats(user_id, category, *_welford(amounts), sign)
+
+def rebuildSpendingStats(user_id, replace=True):
+    """Recomputes a user's stats rows from the ledger. replace=True overwrites existing rows (repair);
+    replace=False only seeds missing ones (backfill). Returns True if the overall row was written."""
+    user_id = uuid.UUID(str(user_id))
+    x = cast(Expense.amount, db.Float)
+    base = db.session.query(func.count(Expense.id), func.avg(x), func.sum(x * x)) \
+        .filter(Expense.user_id == user_id, Expense.type == 'Paid')
+    per_category = base.with_entities(Expense.category, func.count(Expense.id), func.avg(x), func.sum(x * x)) \
+        .group_by(Expense.category).all()
+    rows = [(ALL_CATEGORIES, *base.one())] + per_category
+
+    if replace:
+        SpendingStats.query.filter(SpendingStats.user_id == user_id,
+                                   SpendingStats.category.notin_([r[0] for r in rows])).delete(synchronize_session=False)
+    written = False
+    for category, n, mean, sum_sq in rows:
+        mean = float(mean or 0)
+        # M2 = sum(x^2) - n * mean^2 is fine for a one-off rebuild; increments use the stable merge above
+        values = {"n": n or 0, "mean": mean, "m2": max(float(sum_sq or 0) - (n or 0) * mean * mean, 0.0)}
+        stmt = _dialectInsert(SpendingStats).values(user_id=user_id, category=category, **values)
+        stmt = stmt.on_conflict_do_update(index_elements=['user_id', 'category'], set_=dict(values, updated_at=func.now())) \
+            if replace else stmt.on_conflict_do_nothing(index_elements=['user_id', 'category'])
+        result = db.session.execute(stmt)
+        if category == ALL_CATEGORIES: written = result.rowcount == 1
+    return written
+
+def getSpendingStats(user_id):
+    """{category: SpendingStats} for a user, backfilled on first use."""
+    user_id = uuid.UUID(str(user_id))
+    rows = SpendingStats.query.filter_by(user_id=user_id).populate_existing().all()
+    if not rows:
+        rebuildSpendingStats(user_id, replace=False)
+        rows = SpendingStats.query.filter_by(user_id=user_id).all()
+    return {r.category: r for r in rows}
+
+def addAnomalyWarnings(rows):
+    """Inserts warning dicts (user_id, expense_id, type, reason); a warning already raised for the same
+    (expense_id, type) by another detector is skipped. Returns how many were new. Caller commits."""
+    inserted = 0
+    for i in range(0, len(rows), INGEST_CHUNK):
+        values = [dict(r, id=uuid.uuid4(), is_resolved=False) for r in rows[i:i + INGEST_CHUNK]]
+        result = db.session.execute(_dialectInsert(AnomalyWarning).values(values)
+                                    .on_conflict_do_nothing(index_elements=['expense_id', 'type']))
+        inserted += max(result.rowcount or 0, 0)
+    return inserted
+
+def largeExpenseReason(stats, amount, category):
+    """Warning text if `amount` is a z-score outlier against the user's history (the expense itself
+    excluded), or None. Uses the category's stats when it has enough samples, else the overall stats."""
+    amount = float(amount)
+    if amount <= LARGE_EXPENSE_FLOOR: return None
+    row = stats.get(category)
+    if not row or row.n - 1 < ANOMALY_MIN_SAMPLES: row, category = stats.get(ALL_CATEGORIES), None
+    if not row or row.n < 2: return None
+
+    # Leave-one-out: back the expense out of the running stats before scoring it
+    n = row.n - 1
+    mean = (row.mean * row.n - amount) / n
+    m2 = max(row.m2 - (amount - mean) * (amount - row.mean), 0.0)
+    scope = f"{category} " if category else ""
+    if n < ANOMALY_MIN_SAMPLES:
+        # Too little history for a stable deviation; keep the old 5x-average rule
+        if amount > mean * 5: return f"Large expense of ₹{amount:,.0f} detected. Your avg {scope}spend is ₹{mean:,.0f}."
+        return None
+    std = (m2 / (n - 1)) ** 0.5
+    z = (amount - mean) / std if std else float('inf')
+    if z >= ANOMALY_Z:
+        return f"Large expense of ₹{amount:,.0f} detected ({z:.1f}σ above your avg {scope}spend of ₹{mean:,.0f})."
+    return None
+
+def duplicateChargeIds(user_id, expense_ids):
+    """Subset of `expense_ids` with another expense of the same amount and merchant fingerprint within
+    DUPLICATE_WINDOW on either side. Candidates come from one idx_expenses_duplicate probe per chunk
+    (equality on user/amount/fingerprint, bounded date range), so the cost doesn't grow with history."""
+    user_id = uuid.UUID(str(user_id))
+    found = set()
+    for i in range(0, len(expense_ids), INGEST_CHUNK):
+        ids = [uuid.UUID(str(e)) for e in expense_ids[i:i + INGEST_CHUNK]]
+        rows = db.session.query(Expense.id, Expense.amount, Expense.merchant_fingerprint, Expense.expense_date) \
+            .filter(Expense.id.in_(ids), Expense.user_id == user_id, Expense.expense_date.isnot(None)).all()
+        if not rows: continue
+        candidates = db.session.query(Expense.id, Expense.amount, Expense.merchant_fingerprint, Expense.expense_date).filter(
+            Expense.user_id == user_id,
+            Expense.amount.in_({r.amount for r in rows}),
+            Expense.merchant_fingerprint.in_({r.merchant_fingerprint for r in rows}),
+            Expense.expense_date >= min(r.expense_date for r in rows) - DUPLICATE_WINDOW,
+            Expense.expense_date <= max(r.expense_date for r in rows) + DUPLICATE_WINDOW,
+        ).all()
+        by_key = {}
+        for c in candidates:
+            by_key.setdefault((c.amount, c.merchant_fingerprint), []).append(c)
+        for r in rows:
+            if any(c.id != r.id and abs(c.expense_date - r.expense_date) <= DUPLICATE_WINDOW
+                   for c in by_key.get((r.amount, r.merchant_fingerprint), ())):
+                found.add(r.id)
+    return found
+
+# --- BULK REBUILD ---
+
+def _userRangeFilter(column, lo=None, hi=None):
+    criteria = []
+    if lo is not None: criteria.append(column >= lo)
+    if hi is not None: criteria.append(column < hi)
+    return criteria
+
+def _upsertMonthlySummaries(rows):
+    stmt = _dialectInsert(MonthlySummary).values(rows)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id', 'year', 'month'],
+        set_={f: stmt.excluded[f] for f in ('total_income', 'total_expenses', 'total_savings', 'current_balance', 'goal_status')}
+            | {'last_updated': func.now(), 'updated_at': func.now()}))
+
+def _upsertLedgerTotals(rows, overwrite=True):
+    """overwrite=False only fills in missing rows; one seeded concurrently from the ledger is left alone."""
+    stmt = _dialectInsert(UserLedgerTotals).values(rows)
+    if not overwrite:
+        db.session.execute(stmt.on_conflict_do_nothing(index_elements=['user_id']))
+        return
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={'total_income': stmt.excluded.total_income, 'total_expenses': stmt.excluded.total_expenses, 'updated_at': func.now()}))
+
+def rebuildMonthlySummaries(lo=None, hi=None, close=None, batch_size=1000):
+    """Set-based rebuild of monthly_summaries (and user_ledger_totals) for users with lo <= id < hi.
+
+    Users are taken `batch_size` at a time: their summary and totals rows are locked (the same row locks
+    the ledger deltas and calculateMonthlySummary take), one GROUP BY (user_id, year, month) pass is run for
+    them and upserted, and the commit releases the locks. A write that lands mid-rebuild therefore waits and
+    applies its delta on top instead of being overwritten by a stale aggregate. `close` = (year, month) also
+    materializes that month for users with no expenses in it, so goal_status gets settled for people who
+    never open the dashboard."""
+    started = datetime.utcnow()
+    year_col = func.extract('year', Expense.expense_date)
+    month_col = func.extract('month', Expense.expense_date)
+
+    q = db.session.query(
+        User.id, User.monthly_income, User.savings_goal, year_col, month_col,
+        func.sum(case((Expense.type == 'Paid', Expense.amount), else_=0)),
+        func.sum(case((Expense.type == 'Received', Expense.amount), else_=0))
+    ).outerjoin(Expense, db.and_(Expense.user_id == User.id, Expense.include_in_total == True)) \
+     .group_by(User.id, User.monthly_income, User.savings_goal, year_col, month_col) \
+     .order_by(User.id)
+    users = db.session.query(User.id).filter(*_userRangeFilter(User.id, lo, hi)).order_by(User.id)
+
+    stats = {"users": 0, "rows": 0}
+    summaries, totals, seeds = [], [], []
+    locked = set()
+
+    def flush(force=False):
+        if summaries and (force or len(summaries) >= batch_size):
+            _upsertMonthlySummaries(summaries); stats["rows"] += len(summaries); summaries.clear()
+        if totals and (force or len(totals) >= batch_size):
+            _upsertLedgerTotals(totals); totals.clear()
+        if seeds and (force or len(seeds) >= batch_size):
+            _upsertLedgerTotals(seeds, overwrite=False); seeds.clear()
+
+    def emit(user_id, income, goal, months):
+        income = income or Decimal(0)
+        all_paid = sum((p for p, _ in months.values()), Decimal(0))
+        all_received = sum((r for _, r in months.values()), Decimal(0))
+        balance = income + all_received - all_paid
+        (totals if user_id in locked else seeds).append(
+            {"user_id": user_id, "total_income": all_received, "total_expenses": all_paid})
+
+        if close and close not in months: months[close] = (Decimal(0), Decimal(0))
+        for (year, month), (paid, received) in months.items():
+            if year is None: continue # Undated rows only count towards the all-time balance
+            monthly_income = income + received
+            savings = monthly_income - paid
+            summaries.append({
+                "id": uuid.uuid4(), "user_id": user_id, "year": year, "month": month,
+                "total_income": monthly_income, "total_expenses": paid, "total_savings": savings,
+                "current_balance": balance, "goal_status": _goalStatus(goal, year, month, savings)
+            })
+        stats["users"] += 1
+        flush()
+
+    after = None
+    while True:
+        page = users.filter(User.id > after) if after is not None else users
+        batch = [row.id for row in page.limit(batch_size)]
+        if not batch: break
+        db.session.query(MonthlySummary.id).filter(MonthlySummary.user_id.in_(batch)).with_for_update().all()
+        locked = {row.user_id for row in db.session.query(UserLedgerTotals.user_id)
+                  .filter(UserLedgerTotals.user_id.in_(batch)).with_for_update()}
+
+        current, months = None, {}
+        for user_id, income, goal, year, month, paid, received in q.filter(User.id.in_(batch)):
+            if current is None or user_id != current[0]:
+                if current: emit(*current, months)
+                current, months = (user_id, income, goal), {}
+            if paid is None and received is None and year is None: continue # User without expenses
+            key = (int(year), int(month)) if year is not None else (None, None)
+            p, r = months.get(key, (Decimal(0), Decimal(0)))
+            months[key] = (p + (paid or Decimal(0)), r + (received or Decimal(0)))
+        if current: emit(*current, months)
+        flush(force=True)
+        db.session.commit()  # releases this batch's row locks
+        after = batch[-1]
+
+    # Everything marked before this pass is now covered
+    DirtyMonth.query.filter(DirtyMonth.marked_at <= started, *_userRangeFilter(DirtyMonth.user_id, lo, hi)).delete(synchronize_session=False)
+    db.session.commit()
+
+    stats["seconds"] = (datetime.utcnow() - started).total_seconds()
+    return stats
+
 def generateMicroInvestmentPlan(savingsGoal):
     # Ensure savingsGoal is Decimal
     savingsGoal = Decimal(str(savingsGoal))
@@ -182,116 +986,224 @@ def generateMicroInvestmentPlan(savingsGoal):
 
 # --- PRODUCTION AI ENGINE ---
 
-def run_async_ai(f):
-    """Decorator to run Gemini tasks in background threads to prevent UI blocking."""
-    def wrapper(*args, **kwargs):
-        thread = threading.Thread(target=f, args=args, kwargs=kwargs)
-        thread.daemon = True
-        thread.start()
-    return wrapper
+CATEGORY_CACHE_TTL = 30 * 24 * 3600  # merchant -> category answers barely change
+CATEGORIZE_WINDOW = 30        # seconds a user's new 'Others' rows are collected before one batch call
+CATEGORIZE_BATCH_SIZE = 50    # distinct merchants per prompt
+CATEGORIZE_BATCH_LIMIT = 500  # rows per job; a follow-up job picks up the rest
+INSIGHTS_WINDOW = 60          # seconds of writes coalesced into one insight report per (user, year, month)
+RECEIPT_PROMPT = """
+You are a receipt analysis engine.
+Extract structured financial data from this receipt.
+Return ONLY valid JSON.
 
-def get_ai_model():
+{
+  "merchant": "string",
+  "total_amount": number,
+  "currency": "string",
+  "date": "YYYY-MM-DD",
+  "category": "Food/Travel/Shopping/Bills/Health/others",
+  "confidence_score": number
+}
+No extra text allowed.
+"""
+
+_genai_model = None
+
+def get_ai_model(priority=BACKGROUND):
+    """Shared, rate-limited Gemini client. Interactive callers (a user is waiting) get the reserved headroom."""
+    global _genai_model
     api_key = os.getenv('GOOGLE_API_KEY')
     if not api_key: return None
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-flash-latest')
+    if _genai_model is None:
+        genai.configure(api_key=api_key)
+        _genai_model = genai.GenerativeModel('gemini-flash-latest')
+    return ModelClient(_genai_model, priority)
 
-@run_async_ai
-def categorize_with_ai(expense_id):
-    """Module 3: Refines categorization based on merchant name and user history."""
-    from backend import db # Avoid circular import
-    from backend.models import Expense
-    from backend import create_app
-    app = create_app()
-    with app.app_context():
-        exp = Expense.query.get(expense_id)
-        if not exp or exp.category != 'Others': return
+@background_job(max_attempts=3, concurrency=2, delay=CATEGORIZE_WINDOW, dedupe=True)
+def categorize_batch(user_id, after=None):
+    """Suggests categories for a user's uncategorized expenses: the merchant index answers what it knows,
+    the rest go to the model as one prompt per batch of distinct merchants, and every suggestion is written
+    back with a single UPDATE. Rows are walked in id order; `after` is the last id an earlier batch of this run
+    tried, so rows the model couldn't place are not fetched again until the next run."""
+    from backend.merchant_index import merchantIndex
+    from backend.statements import parse_model_json
+    query = db.session.query(Expense.id, Expense.title).filter(
+        Expense.user_id == user_id, Expense.category == 'Others', Expense.ai_category_suggestion == None)
+    if after:
+        query = query.filter(Expense.id > uuid.UUID(after))
+    pending = query.order_by(Expense.id).limit(CATEGORIZE_BATCH_LIMIT).all()
+    if not pending: return
 
-        model = get_ai_model()
-        if not model: return
+    suggestions, unknown = {}, {}
+    for row in pending:
+        known = merchantIndex.lookup(user_id, row.title)
+        if known: suggestions[row.id] = known
+        else: unknown.setdefault(' '.join(row.title.split()).upper(), []).append(row)
 
-        prompt = f"Categorize this transaction: '{exp.title}'. Valid categories: {CATS}. Return ONLY the category name."
-        try:
-            res = model.generate_content(prompt).text.strip()
-            if res in CATS:
-                exp.ai_category_suggestion = res
-                # We don't auto-save per user rules, just suggest
-                db.session.commit()
-        except: pass
-
-@run_async_ai
+    model = get_ai_model() if unknown else None
+    merchants = list(unknown) if model else []
+    for i in range(0, len(merchants), CATEGORIZE_BATCH_SIZE):
+        batch = merchants[i:i + CATEGORIZE_BATCH_SIZE]
+        lines = "\n".join(f"{n}: {m}" for n, m in enumerate(batch, 1))
+        prompt = f"""Categorize each transaction below. Valid categories: {CATS}.
+Return ONLY a JSON object mapping each number to one category name, e.g. {{"1": "Travel"}}.
+
+{lines}"""
+        answer = parse_model_json(cachedGenerate(model, prompt, ttl=CATEGORY_CACHE_TTL))
+        if not isinstance(answer, dict): continue
+        for n, merchant in enumerate(batch, 1):
+            category = answer.get(str(n))
+            if category in CATS:
+                for row in unknown[merchant]: suggestions[row.id] = category
+
+    if suggestions:
+        db.session.execute(Expense.__table__.update()
+                           .where(Expense.id.in_(list(suggestions)))
+                           .values(ai_category_suggestion=case(suggestions, value=Expense.id)))
+        db.session.commit()
+    if len(pending) == CATEGORIZE_BATCH_LIMIT:
+        categorize_batch(user_id, after=str(pending[-1].id))
+
+@background_job(max_attempts=3, concurrency=4)
 def detect_anomalies(user_id, expense_id):
     """Module 6: Scans for large spikes, duplicates, or unusual spending compared to 30-day average."""
     from backend import db
-    from backend.models import Expense, AnomalyWarning
-    from backend import create_app
-    app = create_app()
-    with app.app_context():
-        exp = Expense.query.get(expense_id)
-        if not exp: return
-
-        # 1. Duplicate check (Exact hash already handled in route, but let's check fuzzy title/amount)
-        matches = Expense.query.filter(
-            Expense.user_id == user_id,
-            Expense.id != exp.id,
-            Expense.amount == exp.amount,
-            Expense.title == exp.title,
-            Expense.expense_date >= (exp.expense_date - timedelta(hours=24))
-        ).first()
-        
-        if matches:
-            warn = AnomalyWarning(user_id=user_id, expense_id=exp.id, type="DUPLICATE", reason="Possible duplicate charge detected within 24 hours.")
-            db.session.add(warn); db.session.commit()
-            return
-
-        # 2. Large Spike Check (Gemini assisted)
-        avg_spend = db.session.query(func.avg(Expense.amount)).filter_by(user_id=user_id, type='Paid').scalar() or 0
-        if exp.amount > (Decimal(str(avg_spend)) * 5) and exp.amount > 1000:
-            warn = AnomalyWarning(user_id=user_id, expense_id=exp.id, type="LARGE_EXPENSE", reason=f"Large expense of ₹{exp.amount} detected. Your avg is ₹{avg_spend:,.0f}.")
-            db.session.add(warn); db.session.commit()
-
-@run_async_ai
+    from backend.models import Expense
+    exp = Expense.query.get(expense_id)
+    if not exp: return
+
+    # 1. Duplicate check (Exact hash already handled in route; this catches the same merchant/amount within 24h)
+    if exp.merchant_fingerprint is None:  # rows written before the fingerprint column existed
+        exp.merchant_fingerprint = merchantFingerprint(exp.title)
+        db.session.flush()
+    if duplicateChargeIds(user_id, [exp.id]):
+        addAnomalyWarnings([{"user_id": exp.user_id, "expense_id": exp.id, "type": "DUPLICATE", "reason": DUPLICATE_REASON}])
+        db.session.commit()
+        return
+
+    # 2. Large Spike Check: z-score against the running per-user/per-category stats (O(1))
+    if exp.type != 'Paid': return
+    reason = largeExpenseReason(getSpendingStats(user_id), exp.amount, exp.category)
+    if reason:
+        addAnomalyWarnings([{"user_id": exp.user_id, "expense_id": exp.id, "type": "LARGE_EXPENSE", "reason": reason}])
+    db.session.commit()
+
+@background_job(max_attempts=3, concurrency=2)
+def detect_statement_anomalies(user_id, expense_ids):
+    """DUPLICATE and LARGE_EXPENSE scan for freshly imported statement rows: chunked duplicate probes, then
+    one load of the rows and one of the stats. A row flagged as a duplicate isn't also scored as large."""
+    duplicates = duplicateChargeIds(user_id, expense_ids)
+    warnings = [{"user_id": uuid.UUID(str(user_id)), "expense_id": e, "type": "DUPLICATE", "reason": DUPLICATE_REASON}
+                for e in duplicates]
+    stats = getSpendingStats(user_id)
+    for i in range(0, len(expense_ids), INGEST_CHUNK):
+        rows = Expense.query.filter(Expense.id.in_([uuid.UUID(str(e)) for e in expense_ids[i:i + INGEST_CHUNK]]),
+                                    Expense.type == 'Paid').all()
+        for exp in rows:
+            if exp.id in duplicates: continue
+            reason = largeExpenseReason(stats, exp.amount, exp.category)
+            if reason:
+                warnings.append({"user_id": exp.user_id, "expense_id": exp.id, "type": "LARGE_EXPENSE", "reason": reason})
+    addAnomalyWarnings(warnings)
+    db.session.commit()
+
+def insightFingerprint(summary, cat_data):
+    """Hash of everything the insight prompt is built from (summary totals + category breakdown)."""
+    snapshot = {
+        "income": str(summary.total_income), "expenses": str(summary.total_expenses), "savings": str(summary.total_savings),
+        "categories": {c: round(v, 2) for c, v in cat_data.items()},
+    }
+    return hashlib.sha256(json.dumps(snapshot, sort_keys=True).encode()).hexdigest()
+
+@background_job(max_attempts=3, concurrency=1, delay=INSIGHTS_WINDOW, dedupe=True)
 def generate_spending_insights(user_id, year, month):
-    """Module 4: Generates a deep financial report based on monthly summary data."""
+    """Module 4: Generates a deep financial report based on monthly summary data.
+    Debounced per (user, year, month); skipped when the inputs match the stored report's fingerprint."""
     from backend import db
-    from backend.models import MonthlySummary, AIReport, Expense
-    from backend import create_app
-    app = create_app()
-    with app.app_context():
-        summary = MonthlySummary.query.filter_by(user_id=user_id, year=year, month=month).first()
-        if not summary: return
-
-        # Get top categories
-        top_cats = db.session.query(Expense.category, func.sum(Expense.amount)).filter_by(user_id=user_id, type='Paid').filter(func.extract('year', Expense.expense_date) == year, func.extract('month', Expense.expense_date) == month).group_by(Expense.category).all()
-        
-        cat_data = {c: float(s) for c, s in top_cats}
-        
-        model = get_ai_model()
-        if not model: return
-
-        prompt = f"""
-        Act as a Professional Fintech AI Coach.
-        Analyze this monthly spending data for a user:
-        Total Income: ₹{summary.total_income}
-        Total Spent: ₹{summary.total_expenses}
-        Savings Goal: ₹{summary.total_savings} (Net)
-        Category Breakdown: {json.dumps(cat_data)}
-
-        Return a human-readable report with:
-        1. Behavior Analysis
-        2. Savings Advice
-        3. Potential Warnings
-        4. Positive Reinforcement
-        Use bullet points and emojis. Keep it professional yet encouraging.
-        """
-        try:
-            report_text = model.generate_content(prompt).text
-            # Store it
-            rep = AIReport.query.filter_by(user_id=user_id, year=year, month=month).first()
-            if not rep:
-                rep = AIReport(user_id=user_id, year=year, month=month, type="MONTHLY_INSIGHT")
-                db.session.add(rep)
-            rep.content = report_text
-            rep.data_snapshot = cat_data
-            db.session.commit()
-        except: pass
+    from backend.models import MonthlySummary, AIReport
+    summary = MonthlySummary.query.filter_by(user_id=user_id, year=year, month=month).first()
+    if not summary: return
+
+    # Get top categories
+    top_cats = ledgerStats(user_id, inPeriod(monthBounds(year, month)))["by_category"]
+    
+    cat_data = {c: float(t["Paid"]) for c, t in top_cats.items() if t["Paid"]}
+    fingerprint = insightFingerprint(summary, cat_data)
+    rep = AIReport.query.filter_by(user_id=user_id, year=year, month=month).first()
+    if rep and rep.snapshot_fingerprint == fingerprint and rep.content: return
+    
+    model = get_ai_model()
+    if not model: return
+
+    prompt = f"""
+    Act as a Professional Fintech AI Coach.
+    Analyze this monthly spending data for a user:
+    Total Income: ₹{summary.total_income}
+    Total Spent: ₹{summary.total_expenses}
+    Savings Goal: ₹{summary.total_savings} (Net)
+    Category Breakdown: {json.dumps(cat_data)}
+
+    Return a human-readable report with:
+    1. Behavior Analysis
+    2. Savings Advice
+    3. Potential Warnings
+    4. Positive Reinforcement
+    Use bullet points and emojis. Keep it professional yet encouraging.
+    """
+    report_text = cachedGenerate(model, prompt)
+    # Store it
+    if not rep:
+        rep = AIReport(user_id=user_id, year=year, month=month, type="MONTHLY_INSIGHT")
+        db.session.add(rep)
+    rep.content = report_text
+    rep.data_snapshot = cat_data
+    rep.snapshot_fingerprint = fingerprint
+    db.session.commit()
+
+def _logAIError(label, e):
+    with open("ai_error_log.txt", "a") as log:
+        log.write(f"[{datetime.utcnow()}] {label}: {str(e)}\n")
+
+@background_job(max_attempts=1, concurrency=3, priority=1)
+def analyze_receipt_file(user_id, sha256, path, mime_type):
+    """Extracts merchant/total/date/category from a stored receipt into receipt_analyses (keyed by file hash).
+    The job owns one blob reference and drops it when done. Errors are recorded on the row for the poller
+    rather than retried, since a user is waiting on the result. `mime_type` is only a hint; the file is sniffed
+    and compacted (resized, EXIF stripped, PDFs rendered) before upload."""
+    from backend.blob_store import openBlob, releaseBlob
+    from backend.statements import parse_model_json
+    from backend.receipt_images import compactReceipt
+    try:
+        row = ReceiptAnalysis.query.get(sha256)
+        if row and row.status == 'done': return  # another upload of the same file got there first
+        result, error, compact = None, None, None
+        model = get_ai_model(priority=INTERACTIVE)
+        if model is None:
+            error = "AI Config Missing"
+        else:
+            try:
+                with openBlob(path) as f:
+                    cfg = current_app.config
+                    compact = compactReceipt(f, mime_type, cfg['RECEIPT_MAX_DIM'], cfg['RECEIPT_JPEG_QUALITY'], cfg['RECEIPT_PDF_PAGES'])
+                result = parse_model_json(cachedGenerate(model, [RECEIPT_PROMPT, {'mime_type': compact.mime_type, 'data': compact.data}]))
+                if not isinstance(result, dict): raise ValueError("Model did not return a JSON object")
+            except genai.types.BlockedPromptException as e:
+                _logAIError("AI BLOCKED PROMPT ERROR", e)
+                error = "AI blocked the prompt due to safety concerns."
+            except AIUnavailable as e:
+                # Quota exhausted, breaker open or retries used up
+                _logAIError("AI UNAVAILABLE", e)
+                error = "AI service is busy. Please try again later."
+            except Exception as e:
+                _logAIError("AI EXTRACTION ERROR", e)
+                error = "AI processing failed. Please try again later."
+
+        values = {"status": 'failed' if error else 'done', "result": result, "error": error, "updated_at": datetime.utcnow(),
+                  "original_bytes": compact and compact.original_bytes, "compacted_bytes": compact and compact.compacted_bytes}
+        # A concurrent job for the same file may have stored a result; never replace a good one with a failure
+        db.session.execute(_dialectInsert(ReceiptAnalysis).values(sha256=sha256, created_at=values["updated_at"], **values)
+                           .on_conflict_do_update(index_elements=['sha256'], set_=values,
+                                                  where=ReceiptAnalysis.status != 'done'))
+        db.session.commit()
+    finally:
+        releaseBlob(path)